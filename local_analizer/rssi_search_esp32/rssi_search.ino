@@ -32,10 +32,12 @@ void IRAM_ATTR wifi_sniffer_cb(void* buf, wifi_promiscuous_pkt_type_t type) {
   // Фильтр по минимальному RSSI
   if (rssi < MIN_RSSI) return;
 
-  // Отправка времени и RSSI в Serial
+  // Отправка времени, RSSI и канала в Serial
   Serial.print(millis());
   Serial.print(",");
-  Serial.println(rssi);
+  Serial.print(rssi);
+  Serial.print(",");
+  Serial.println(ppkt->rx_ctrl.channel);
 }
 
 // ---------------- Настройка сниффера ----------------
@@ -70,7 +72,7 @@ void setup() {
   delay(2000);
   
   Serial.println("RSSI_COLLECTOR_START");
-  Serial.println("Format: timestamp,rssi");
+  Serial.println("Format: timestamp,rssi,channel");
   
   if (!startSniffer()) {
     Serial.println("ERROR: Init failed");
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for BusDistributionAnalyzer
+- Замеряет время и пиковую память каждого этапа анализа на синтетическом потоке
+  от 10^3 до 10^7 пакетов
+- Результаты дописываются в JSONL файл (по строке на запуск, с коммитом), чтобы
+  сравнивать запуски между коммитами: python benchmark.py --compare
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from multi_receiver import MultiReceiverAnalyzer, StreamMerger
+from pars_vis import BusDistributionAnalyzer
+from synthetic_rssi import generate_stream, load_profile
+
+
+DEFAULT_SIZES = '1e3,1e4,1e5,1e6,1e7'
+DEFAULT_RESULTS = 'benchmark_results.jsonl'
+RECEIVERS = 3
+
+
+def multi_receiver_stream(df, receivers=RECEIVERS, seed=0):
+    """Тот же поток, разложенный по приемникам: (ts_us, receiver) по возрастанию времени"""
+    rng = np.random.default_rng(seed)
+    ts = df['datetime'].to_numpy('datetime64[us]').astype(np.int64)
+    order = np.argsort(ts, kind='stable')
+    return ts[order], rng.integers(0, receivers, len(ts))
+
+
+def stages(analyzer, multi):
+    """
+    (имя, функция(входные данные), от какого этапа берутся входные данные).
+    plot_devices_per_minute включает group_similar_devices, как и в run_continuous_analysis;
+    plot_distribution замеряется без него. merge_streams и match_frames - горячие циклы
+    multi_receiver.py на том же потоке, разложенном по RECEIVERS приемникам;
+    merge_streams включает заполнение очередей приемников.
+    """
+    def plot_distribution(df):
+        analyzer.plot_total_devices_per_minute = lambda *args: None
+        try:
+            analyzer.plot_distribution_analysis(df, 0)
+        finally:
+            del analyzer.plot_total_devices_per_minute
+
+    def merge_streams(df):
+        ts, receiver = multi_receiver_stream(df)
+        rssi = df['rssi'].to_numpy()
+        for r in multi.receivers:
+            mine = receiver == r.index
+            r.pending.clear()
+            r.pending.extend(zip(ts[mine].tolist(), rssi[mine].tolist(), [0] * int(mine.sum())))
+        return sum(1 for _ in StreamMerger(multi.receivers).pop_ready(0, flush=True))
+
+    def match_frames(df):
+        return multi.match_frames(*multi_receiver_stream(df))
+
+    return [
+        ('filter_short_stops', lambda df: analyzer.filter_short_stops(), 'stream'),
+        ('calculate_distribution', lambda df: analyzer.calculate_distribution(df.copy()), 'filter_short_stops'),
+        ('save_data_to_csv', lambda df: analyzer.save_data_to_csv(df, 0), 'calculate_distribution'),
+        ('generate_summary', lambda df: analyzer.generate_summary(df, 0), 'calculate_distribution'),
+        ('group_similar_devices', lambda df: analyzer.group_similar_devices(df[df['location_level'] >= 0]), 'calculate_distribution'),
+        ('plot_distribution', plot_distribution, 'calculate_distribution'),
+        ('plot_devices_per_minute', lambda df: analyzer.plot_total_devices_per_minute(df, 0), 'calculate_distribution'),
+        ('merge_streams', merge_streams, 'stream'),
+        ('match_frames', match_frames, 'stream'),
+    ]
+
+
+def measure(func, data, repeat, memory):
+    """Лучшее время из `repeat` запусков и пик памяти (МБ) отдельным запуском под tracemalloc"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func(data)
+            times.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                func(data)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+
+    return min(times), peak_mb, result
+
+
+def git_commit():
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True, cwd=cwd).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True, cwd=cwd).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(sizes, pps, devices, stops, repeat, memory, budget, only=None):
+    profile = load_profile()
+    results = []
+    # Время последнего замера этапа: если при росте размера этап заведомо не уложится
+    # в бюджет (рост хотя бы линейный), дальше он пропускается
+    last = {}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        analyzer = BusDistributionAnalyzer(output_dir=output_dir)
+        # порты не открываются: замеряются только слияние и сопоставление кадров
+        multi = MultiReceiverAnalyzer([(f'bench{i}', i / (RECEIVERS - 1)) for i in range(RECEIVERS)],
+                                      output_dir=output_dir)
+
+        for packets in sizes:
+            print(f"\n{packets} пакетов")
+            outputs = {'stream': generate_stream(packets, pps=pps, devices=devices, stops=stops, profile=profile)}
+            analyzer.df = outputs['stream']
+
+            for name, func, source in stages(analyzer, multi):
+                data = outputs.get(source)
+                prev = last.get(name)
+                if data is None:
+                    status = 'skipped: no input'
+                elif only and name not in only and name not in ('filter_short_stops', 'calculate_distribution'):
+                    continue
+                elif prev is not None and prev[1] * packets / prev[0] > budget:
+                    status = 'skipped: over budget'
+                else:
+                    status = 'ok'
+
+                if status != 'ok':
+                    results.append({'stage': name, 'packets': packets, 'status': status})
+                    print(f"  {name:<24} {status}")
+                    continue
+
+                seconds, peak_mb, outputs[name] = measure(func, data, repeat, memory and (not only or name in only))
+                last[name] = (packets, seconds)
+                results.append({'stage': name, 'packets': packets, 'status': 'ok',
+                                'seconds': round(seconds, 6),
+                                'peak_mb': None if peak_mb is None else round(peak_mb, 3)})
+                memory_str = f"{peak_mb:10.1f} МБ" if peak_mb is not None else ''
+                print(f"  {name:<24} {seconds:10.4f} с {memory_str}")
+
+            del outputs
+            analyzer.df = None
+
+    return results
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(current, baseline, threshold):
+    """Печатает изменения относительно baseline; возвращает число регрессий больше threshold"""
+    base = {(r['stage'], r['packets']): r for r in baseline['results'] if r['status'] == 'ok'}
+    regressions = 0
+
+    print(f"\nСравнение с {baseline['commit']} ({baseline['run_at']})")
+    print(f"{'этап':<24} {'пакетов':>9} {'было, с':>10} {'стало, с':>10} {'изм.':>8}")
+    for r in current['results']:
+        old = base.get((r['stage'], r['packets']))
+        if r['status'] != 'ok' or old is None:
+            continue
+        change = r['seconds'] / old['seconds'] - 1 if old['seconds'] else 0
+        mark = ''
+        if change > threshold:
+            mark = '  РЕГРЕССИЯ'
+            regressions += 1
+        print(f"{r['stage']:<24} {r['packets']:>9} {old['seconds']:>10.4f} {r['seconds']:>10.4f} {change:>+8.0%}{mark}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк этапов BusDistributionAnalyzer')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='размеры потока в пакетах через запятую')
+    parser.add_argument('--pps', type=float, default=4.0, help='пакетов в секунду записи')
+    parser.add_argument('--devices', type=int, default=30, help='число устройств в салоне')
+    parser.add_argument('--stops', default='90:40,20:40', help='шаблон "запись:тишина" в секундах')
+    parser.add_argument('--stages', default=None, help='замерять только эти этапы (через запятую)')
+    parser.add_argument('--repeat', type=int, default=1, help='запусков на замер, берется лучший')
+    parser.add_argument('--budget', type=float, default=60, help='примерный лимит секунд на один замер')
+    parser.add_argument('--no-memory', action='store_true', help='не замерять пиковую память')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='JSONL файл с результатами')
+    parser.add_argument('--compare', nargs='?', const='previous', default=None,
+                        help='сравнить с предыдущим запуском или с запуском указанного коммита')
+    parser.add_argument('--threshold', type=float, default=0.2, help='рост времени, считающийся регрессией')
+    args = parser.parse_args()
+
+    sizes = [int(float(x)) for x in args.sizes.split(',')]
+    only = set(args.stages.split(',')) if args.stages else None
+
+    results = run(sizes, args.pps, args.devices, args.stops, args.repeat,
+                  not args.no_memory, args.budget, only)
+
+    current = {
+        'run_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': f'{platform.machine()} {os.cpu_count()} cpu',
+        'params': {'pps': args.pps, 'devices': args.devices, 'stops': args.stops, 'repeat': args.repeat},
+        'results': results,
+    }
+
+    previous = load_runs(args.results)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(current, ensure_ascii=False) + '\n')
+    print(f"\nРезультаты дописаны в {args.results}")
+
+    if args.compare:
+        if args.compare == 'previous':
+            candidates = previous[-1:]
+        else:
+            candidates = [r for r in previous if r['commit'].startswith(args.compare)][-1:]
+        if not candidates:
+            print("Нет запуска для сравнения")
+            return
+        if compare(current, candidates[0], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
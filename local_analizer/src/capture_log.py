@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Crash-safe raw capture log
+- Пакеты с ESP32 пишутся фиксированными записями (время, RSSI, канал, приемник) в заранее
+  выделенный файл-сегмент через mmap; записанное переживает падение процесса,
+  а после flush() и потерю питания
+- Сегмент заполняется до конца, затем открывается следующий; место под сегмент
+  выделяется на диске заранее, старые сегменты удаляются по лимиту retention_bytes
+- Чтение - без копирования: numpy memmap со структурированным dtype
+"""
+
+import errno
+import glob
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+
+MAGIC = b'RSSILOG1'
+HEADER = struct.Struct('<8sIIqq')  # magic, версия, размер записи, емкость, время создания (мкс)
+HEADER_SIZE = 64
+SEGMENT_SUFFIX = '.rssi'
+
+# 16 байт: запись никогда не пересекает границу страницы. valid пишется вместе с
+# записью и отличает ее от нулей незаполненной части сегмента
+RECORD = np.dtype([
+    ('ts_us', '<i8'),
+    ('rssi', 'i1'),
+    ('channel', 'u1'),
+    ('valid', 'u1'),
+    ('receiver', 'u1'),  # номер приемника, 0 при одном приемнике
+    ('_pad', 'V4'),
+])
+
+
+def preallocate(file, size):
+    """
+    Выделяет size байт на диске. truncate() дает разреженный файл: место занимается
+    только при записи в страницу mmap, и на полном диске (SD карта) процесс падает
+    с SIGBUS. Здесь нехватка места - обычный OSError при открытии сегмента
+    """
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+        return
+    except AttributeError:
+        pass  # Windows, macOS
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+            raise
+    # Файловая система без fallocate: явная запись нулей занимает блоки
+    file.seek(0)
+    chunk = bytes(2**20)
+    for offset in range(0, size, len(chunk)):
+        file.write(chunk[:min(len(chunk), size - offset)])
+    file.flush()
+    os.fsync(file.fileno())
+
+
+class CaptureLog:
+    """
+    Дописывает записи в сегменты <directory>/capture-<время>-<pid>-<N>.rssi по segment_bytes каждый.
+    Сегменты каталога (в том числе прошлых запусков) сверх retention_bytes удаляются, начиная со старых;
+    текущий сегмент не удаляется никогда
+    """
+    def __init__(self, directory, segment_bytes=16 * 2**20, retention_bytes=2**30):
+        self.directory = directory
+        self.capacity = max(1, (segment_bytes - HEADER_SIZE) // RECORD.itemsize)
+        self.retention_bytes = retention_bytes
+        self.segments = []  # пути всех сегментов этого лога, по порядку
+        self.file = None
+        self.mmap = None
+        self.records = None
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self):
+        self.close()
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{len(self.segments) + 1:04d}{SEGMENT_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        size = HEADER_SIZE + self.capacity * RECORD.itemsize
+        self.prune(reserve=size)
+
+        self.file = open(path, 'w+b')
+        try:
+            preallocate(self.file, size)  # незаполненная часть - нули
+        except OSError:
+            self.file.close()
+            self.file = None
+            os.remove(path)
+            raise
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, 1, RECORD.itemsize, self.capacity, time.time_ns() // 1000))
+        self.file.flush()
+        self.mmap = mmap.mmap(self.file.fileno(), size)
+        self.records = np.frombuffer(self.mmap, dtype=RECORD, count=self.capacity, offset=HEADER_SIZE)
+        self.count = 0
+        self.segments.append(path)
+
+    def append(self, ts_us, rssi, channel=0, receiver=0):
+        if self.records is None or self.count >= self.capacity:
+            self._open_segment()
+        self.records[self.count] = (ts_us, rssi, channel, 1, receiver, b'')
+        self.count += 1
+
+    def prune(self, reserve=0):
+        """Удаляет старые сегменты, пока они вместе с reserve байтами нового не укладываются в retention_bytes"""
+        if self.retention_bytes is None:
+            return
+        paths = sorted(glob.glob(os.path.join(self.directory, f'*{SEGMENT_SUFFIX}')), key=os.path.getmtime)
+        sizes = [os.path.getsize(p) for p in paths]
+        total = sum(sizes) + reserve
+        for path, size in zip(paths, sizes):
+            if total <= self.retention_bytes:
+                break
+            os.remove(path)
+            total -= size
+            print(f"Удален старый сегмент {os.path.basename(path)}")
+
+    def position(self):
+        """(номер сегмента, номер записи) - начало следующей записи, для read_range"""
+        if self.records is None or self.count >= self.capacity:
+            return len(self.segments), 0
+        return len(self.segments) - 1, self.count
+
+    def read_range(self, start):
+        """Записи этого лога начиная с position() = start, как список memmap-срезов"""
+        segment, index = start
+        return [read_segment(path)[index if i == segment else 0:]
+                for i, path in enumerate(self.segments) if i >= segment and os.path.exists(path)]
+
+    def flush(self):
+        """Сбрасывает записанное на диск (msync)"""
+        if self.mmap is not None:
+            self.mmap.flush()
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.flush()
+            self.records = None
+            self.mmap.close()
+            self.file.close()
+            self.mmap = self.file = None
+
+
+def read_segment(path):
+    """Заполненная часть сегмента как структурированный numpy массив (memmap, без копирования)"""
+    with open(path, 'rb') as f:
+        magic, _, record_size, capacity, _ = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or record_size != RECORD.itemsize:
+        raise ValueError(f"{path}: не сегмент capture log")
+
+    records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(capacity,))
+    # Записи идут подряд: первая невалидная - конец записанного (или оборванная запись)
+    empty = np.flatnonzero(records['valid'] == 0)
+    return records[:empty[0] if len(empty) else capacity]
+
+
+def segment_paths(path):
+    """Сегменты по пути к файлу или каталогу, по порядку записи"""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f'*{SEGMENT_SUFFIX}')))
+    return [path]
+
+
+def to_dataframe(chunks):
+    """DataFrame(datetime, rssi, channel, receiver) из массивов записей - единственная копия данных"""
+    chunks = [c for c in chunks if len(c)]
+    if not chunks:
+        return pd.DataFrame({'datetime': pd.Series(dtype='datetime64[ns]'), 'rssi': pd.Series(dtype='int64'),
+                             'channel': pd.Series(dtype='int64'), 'receiver': pd.Series(dtype='int64')})
+    ts_us = np.concatenate([c['ts_us'] for c in chunks])
+    return pd.DataFrame({
+        'datetime': pd.to_datetime(ts_us, unit='us'),
+        'rssi': np.concatenate([c['rssi'] for c in chunks]).astype(np.int64),
+        'channel': np.concatenate([c['channel'] for c in chunks]).astype(np.int64),
+        'receiver': np.concatenate([c['receiver'] for c in chunks]).astype(np.int64),
+    })
+
+
+def load_dataframe(path):
+    return to_dataframe([read_segment(p) for p in segment_paths(path)])
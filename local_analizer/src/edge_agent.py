@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Edge store-and-forward agent
+- Кадры камер и сводки RSSI сначала пишутся на диск (outbox), связь не нужна
+- Записи собираются в пачки, пачка сжимается gzip; ряды сводок RSSI кодируются
+  разностями, поэтому сжимаются в разы лучше
+- Пачки отправляются одним запросом в POST /api/v1/edge/ingest crowd_analysis_service,
+  по порядку; при ошибке - повтор с нарастающей паузой, с той же пачки
+- Только стандартная библиотека: работает рядом с анализатором без новых зависимостей
+"""
+
+import glob
+import gzip
+import http.client
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+
+SUMMARY_FIELDS = ['minute', 'front', 'middle', 'back', 'noise', 'mean_rssi']
+
+
+def delta_encode(rows, fields):
+    """Первая строка как есть, дальше - разности с предыдущей (целые значения)"""
+    encoded = []
+    previous = None
+    for row in rows:
+        values = [int(row[field]) for field in fields]
+        encoded.append(values if previous is None else [v - p for v, p in zip(values, previous)])
+        previous = values
+    return encoded
+
+
+def rssi_summary_rows(df):
+    """
+    Поминутная сводка цикла из df после calculate_distribution: число пакетов
+    по зонам и средний RSSI. minute - минуты от 1970-01-01 (локальное время)
+    """
+    if df is None or len(df) == 0:
+        return []
+    minute = df['datetime'].dt.floor('min')
+    counts = df.groupby([minute, 'location_label']).size().unstack(fill_value=0)
+    mean_rssi = df.groupby(minute)['rssi'].mean()
+
+    rows = []
+    for ts, row in counts.iterrows():
+        rows.append({
+            'minute': int((ts - datetime(1970, 1, 1)).total_seconds() // 60),
+            'front': int(row.get('Front', 0)),
+            'middle': int(row.get('Middle', 0)),
+            'back': int(row.get('Back', 0)),
+            'noise': int(row.get('Noise', 0)),
+            'mean_rssi': int(round(mean_rssi[ts])),
+        })
+    return rows
+
+
+class EdgeAgent:
+    def __init__(self, server_url, bus_num, outbox_dir='results/outbox', batch_bytes=2**20,
+                 batch_age_s=60, timeout=30, max_backoff_s=300):
+        """
+        server_url - адрес crowd_analysis_service, например http://host:1338.
+        Пачка закрывается, когда в ней batch_bytes несжатых данных или ей batch_age_s секунд
+        """
+        self.url = server_url.rstrip('/') + '/api/v1/edge/ingest'
+        self.bus_num = str(bus_num)
+        self.outbox_dir = outbox_dir
+        self.batch_bytes = batch_bytes
+        self.batch_age_s = batch_age_s
+        self.timeout = timeout
+        self.max_backoff_s = max_backoff_s
+        self.lock = threading.Lock()
+        self.current_path = os.path.join(outbox_dir, f'current-{os.getpid()}.ndjson')
+        self.current = None
+        self.current_opened = 0.0
+        self.sealed = 0
+        self.stats = {'queued': 0, 'batches_sent': 0, 'bytes_sent': 0, 'upload_errors': 0}
+        self.thread = None
+        self.running = False
+        os.makedirs(outbox_dir, exist_ok=True)
+        self._seal_orphans()
+
+    # ---------------- Очередь на диске ----------------
+
+    def _seal_orphans(self):
+        # Незакрытые пачки процессов, которые уже не работают (падение, перезагрузка)
+        for path in glob.glob(os.path.join(self.outbox_dir, 'current-*.ndjson')):
+            pid = int(path.rsplit('-', 1)[1].split('.')[0])
+            if pid != os.getpid() and not _pid_alive(pid):
+                self._compress(path)
+
+    def _append(self, record):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if self.current is None:
+                self.current = open(self.current_path, 'ab')
+                self.current_opened = time.monotonic()
+            self.current.write(line)
+            self.current.flush()
+            os.fsync(self.current.fileno())
+            self.stats['queued'] += 1
+            if self.current.tell() >= self.batch_bytes:
+                self._seal_locked()
+
+    def put_frame(self, images, lat=None, lon=None, taken_at=None):
+        """Снимок автобуса: список изображений в формате POST /api/v1/crowd_analysis"""
+        taken_at = time.time() if taken_at is None else taken_at
+        for image in images:
+            image = {'bus_num': self.bus_num, 'timestamp': int(taken_at), **image}
+            if lat is not None and lon is not None:
+                image.setdefault('lat', lat)
+                image.setdefault('lon', lon)
+            self._append({'type': 'frame', 'bus_num': self.bus_num, 'taken_at': taken_at, 'image': image})
+
+    def put_rssi_summary(self, rows):
+        if rows:
+            self._append({'type': 'rssi', 'bus_num': self.bus_num, 'fields': SUMMARY_FIELDS,
+                          'encoding': 'delta', 'rows': delta_encode(rows, SUMMARY_FIELDS)})
+
+    def seal(self):
+        with self.lock:
+            self._seal_locked()
+
+    def _seal_locked(self):
+        if self.current is None:
+            return
+        self.current.close()
+        self.current = None
+        self._compress(self.current_path)
+
+    def _compress(self, path):
+        self.sealed += 1
+        name = f"batch-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.sealed:06d}.ndjson.gz"
+        target = os.path.join(self.outbox_dir, name)
+        with open(path, 'rb') as f:
+            data = gzip.compress(f.read(), compresslevel=6)
+        with open(target + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + '.tmp', target)  # пачка появляется целиком или не появляется
+        os.remove(path)
+
+    def pending_batches(self):
+        return sorted(glob.glob(os.path.join(self.outbox_dir, 'batch-*.ndjson.gz')))
+
+    # ---------------- Отправка ----------------
+
+    def _upload(self, path):
+        with open(path, 'rb') as f:
+            body = f.read()
+        request = urllib.request.Request(self.url, data=body, method='POST', headers={
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': 'gzip',
+            # Имя пачки - ключ идемпотентности: повтор после обрыва не анализируется дважды
+            'X-Batch-Id': f'{self.bus_num}/{os.path.basename(path)}',
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+        self.stats['bytes_sent'] += len(body)
+
+    def upload_pending(self):
+        """Отправляет пачки по порядку до первой ошибки; возвращает число отправленных"""
+        sent = 0
+        for path in self.pending_batches():
+            try:
+                self._upload(path)
+            except FileNotFoundError:
+                continue  # уже отправлена другим процессом
+            except urllib.error.HTTPError as e:
+                self.stats['upload_errors'] += 1
+                # 409 - эту пачку еще анализирует предыдущая попытка: повторить позже
+                if 400 <= e.code < 500 and e.code not in (408, 409, 429):
+                    # Пачку сервер не примет никогда: откладываем, чтобы не блокировать очередь
+                    os.replace(path, path + '.rejected')
+                    print(f"Пачка {os.path.basename(path)} отклонена сервером: {e.code}")
+                    continue
+                return sent
+            except (OSError, http.client.HTTPException):
+                # Нет связи или обрыв: пачка остается первой в очереди
+                self.stats['upload_errors'] += 1
+                return sent
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.stats['batches_sent'] += 1
+            sent += 1
+        return sent
+
+    def run(self, interval_s=5):
+        """Цикл в фоне: закрывает старые пачки и отправляет очередь, при ошибках ждет дольше"""
+        backoff = interval_s
+        while self.running:
+            with self.lock:
+                if self.current is not None and time.monotonic() - self.current_opened >= self.batch_age_s:
+                    self._seal_locked()
+            pending = len(self.pending_batches())
+            sent = self.upload_pending()
+            if sent < pending:
+                backoff = min(backoff * 2, self.max_backoff_s)
+            else:
+                backoff = interval_s
+            time.sleep(backoff * random.uniform(0.8, 1.2))
+
+    def start(self, interval_s=5):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(interval_s,), name='edge-agent', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.seal()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def main():
+    # Отдельный процесс только для отправки: очередь заполняет анализатор (EDGE_SERVER_URL)
+    agent = EdgeAgent(os.getenv('EDGE_SERVER_URL', 'http://localhost:1338'), os.getenv('BUS_NUM', '0'),
+                      outbox_dir=os.getenv('EDGE_OUTBOX', 'results/outbox'))
+    agent.running = True
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        print("\nОтправка остановлена")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Multi-receiver Bus Signal Distribution Analyzer
+- Несколько ESP32 на разных COM портах (например спереди, в середине и сзади),
+  каждый читается своим потоком
+- Потоки сводятся в один упорядоченный по времени (k-way merge) с поправкой на
+  сдвиг millis() каждого приемника
+- Зона определяется по относительному RSSI одного и того же кадра на разных
+  приемниках, а не по фиксированным порогам одного приемника
+"""
+
+import heapq
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import serial
+
+from pars_vis import EPOCH, BusDistributionAnalyzer
+
+
+SERVICE_PREFIXES = ("RSSI_COLLECTOR_START", "Format:", "ERROR:", "E (")
+RSSI_FLOOR = -100
+ZONE_LABELS = np.array(['Front', 'Middle', 'Back', 'Noise'])  # индекс -1 -> Noise
+
+
+def now_us():
+    return (datetime.now() - EPOCH) // timedelta(microseconds=1)
+
+
+class ClockSync:
+    """
+    Сдвиг millis() приемника относительно часов компьютера: минимум
+    (время приема - millis) за окно. Задержки порта и буферизации только
+    увеличивают разницу, поэтому минимум - лучшая оценка. Окно обновляется,
+    чтобы учитывать уход кварца ESP32.
+    """
+    def __init__(self, window_s=60):
+        self.window_us = window_s * 1_000_000
+        self.offset = None
+        self.candidate = None
+        self.window_start = None
+        self.last_device_us = None
+
+    def correct(self, device_us, host_us):
+        if self.last_device_us is not None and device_us < self.last_device_us - 1_000_000:
+            # Перезагрузка ESP32 или переполнение millis()
+            self.offset = None
+        self.last_device_us = device_us
+
+        sample = host_us - device_us
+        if self.offset is None:
+            self.offset = self.candidate = sample
+            self.window_start = host_us
+        else:
+            self.offset = min(self.offset, sample)
+            self.candidate = min(self.candidate, sample)
+            if host_us - self.window_start >= self.window_us:
+                self.offset, self.candidate = self.candidate, sample
+                self.window_start = host_us
+        return device_us + self.offset
+
+
+class Receiver:
+    """Один ESP32: поток чтения порта -> ограниченная очередь пакетов с исправленным временем"""
+    def __init__(self, index, port, position, baudrate=115200, max_pending=50000):
+        self.index = index
+        self.port = port
+        self.position = position
+        self.baudrate = baudrate
+        self.max_pending = max_pending
+        self.pending = deque()  # (ts_us, rssi, channel) по возрастанию времени
+        self.clock = ClockSync()
+        self.counters = self._new_counters()
+        self.last_ts = 0
+        self.connection = None
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def _new_counters():
+        counters = BusDistributionAnalyzer._new_counters()
+        counters['packets_dropped'] = 0
+        return counters
+
+    def connect(self):
+        try:
+            if self.connection:
+                self.connection.close()
+            self.connection = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=1)
+            print(f"Подключено к {self.port} (положение {self.position})")
+            return True
+        except Exception as e:
+            print(f"Ошибка подключения к {self.port}: {e}")
+            return False
+
+    def start(self):
+        self.counters = self._new_counters()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f'serial-reader-{self.index}', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        buffer = b''
+        while self.running:
+            try:
+                waiting = self.connection.in_waiting
+                if not waiting:
+                    time.sleep(0.01)
+                    continue
+                self.counters['serial_backlog_max'] = max(self.counters['serial_backlog_max'], waiting)
+                raw = self.connection.read(waiting)
+                received = now_us()
+                self.counters['serial_bytes'] += len(raw)
+                *lines, buffer = (buffer + raw).split(b'\n')
+                for line in lines:
+                    self._parse(line, received)
+            except Exception as e:
+                print(f"Ошибка чтения данных {self.port}: {e}")
+                break
+
+    def _parse(self, line, received):
+        line = line.decode('utf-8', errors='ignore').strip()
+        if not line:
+            return
+        if line.startswith(SERVICE_PREFIXES) or "wifi:failed to post WiFi event" in line:
+            self.counters['service_lines'] += 1
+            return
+
+        parts = line.split(',')
+        try:
+            if len(parts) not in (2, 3):
+                raise ValueError(line)
+            device_us = int(parts[0]) * 1000
+            rssi = int(parts[1])
+            channel = int(parts[2]) if len(parts) == 3 else 0
+        except ValueError:
+            self.counters['lines_rejected'] += 1
+            return
+
+        # Поток одного приемника остается упорядоченным, даже когда оценка сдвига уточняется
+        ts = max(self.clock.correct(device_us, received), self.last_ts)
+        self.last_ts = ts
+
+        if len(self.pending) >= self.max_pending:
+            # Слияние не успевает: теряем самые старые пакеты, но не память
+            self.pending.popleft()
+            self.counters['packets_dropped'] += 1
+        self.pending.append((ts, rssi, channel))
+        self.counters['packets_parsed'] += 1
+
+
+class StreamMerger:
+    """
+    k-way слияние упорядоченных потоков приемников через кучу из одного пакета
+    на приемник. Пакет выдается, когда раньше него уже ничего не придет: у
+    каждого приемника есть следующий пакет, или пакет старше `lateness_ms`.
+    """
+    def __init__(self, receivers, lateness_ms=500):
+        self.receivers = receivers
+        self.lateness_us = lateness_ms * 1000
+        self.heap = []  # (ts_us, receiver, rssi, channel)
+        self.in_heap = [False] * len(receivers)
+
+    def _refill(self):
+        for receiver in self.receivers:
+            if self.in_heap[receiver.index]:
+                continue
+            try:
+                ts, rssi, channel = receiver.pending.popleft()
+            except IndexError:
+                continue
+            heapq.heappush(self.heap, (ts, receiver.index, rssi, channel))
+            self.in_heap[receiver.index] = True
+
+    def pop_ready(self, now, flush=False):
+        """Готовые пакеты (ts_us, receiver, rssi, channel) по возрастанию времени"""
+        while True:
+            self._refill()
+            if not self.heap:
+                return
+            ts, index, rssi, channel = self.heap[0]
+            if not (flush or len(self.heap) == len(self.receivers) or ts <= now - self.lateness_us):
+                return
+            heapq.heappop(self.heap)
+            self.in_heap[index] = False
+            yield ts, index, rssi, channel
+
+    def __len__(self):
+        return len(self.heap) + sum(len(r.pending) for r in self.receivers)
+
+
+class MultiReceiverAnalyzer(BusDistributionAnalyzer):
+    def __init__(self, receivers, baudrate=115200, output_dir='results', lateness_ms=500,
+                 match_window_ms=8, **kwargs):
+        """
+        receivers - [(порт, положение)], положение от 0 (перед) до 1 (зад автобуса).
+        Пакеты разных приемников в пределах match_window_ms считаются одним кадром:
+        окно - погрешность сведения часов (~1 мс разрешение millis и разброс задержки порта).
+        """
+        super().__init__(com_port=receivers[0][0], baudrate=baudrate, output_dir=output_dir, **kwargs)
+        self.receivers = [Receiver(i, port, position, baudrate) for i, (port, position) in enumerate(receivers)]
+        self.merger = StreamMerger(self.receivers, lateness_ms)
+        self.match_window_us = match_window_ms * 1000
+
+    @staticmethod
+    def _new_counters():
+        counters = BusDistributionAnalyzer._new_counters()
+        counters['queue_depth_max'] = 0  # пакеты всех приемников, ждущие слияния
+        return counters
+
+    def connect_serial(self):
+        for receiver in self.receivers:
+            if not receiver.connect():
+                return False
+            receiver.start()
+        return True
+
+    def _queue_depth(self):
+        return len(self.merger)
+
+    def _read_serial_data(self):
+        # Здесь поток не читает порт, а сливает потоки приемников в capture log
+        deadline = self.collection_start_time + timedelta(minutes=self.collection_duration)
+        while self.is_collecting and datetime.now() < deadline:
+            self._drain()
+            time.sleep(0.05)
+        self.is_collecting = False
+
+        for receiver in self.receivers:
+            receiver.stop()
+        self._drain(flush=True)
+        for receiver in self.receivers:
+            for key, value in receiver.counters.items():
+                if key.endswith('_max'):
+                    self.counters[key] = max(self.counters.get(key, 0), value)
+                else:
+                    self.counters[key] = self.counters.get(key, 0) + value
+
+    def _drain(self, flush=False):
+        self.counters['queue_depth_max'] = max(self.counters['queue_depth_max'], self._queue_depth())
+        for ts, index, rssi, channel in self.merger.pop_ready(now_us(), flush):
+            self.capture.append(ts, rssi, channel, index)
+        self.capture.flush()
+
+    def stop_data_collection(self):
+        for receiver in self.receivers:
+            receiver.stop()
+            if receiver.connection:
+                receiver.connection.close()
+        super().stop_data_collection()
+
+    def match_frames(self, ts, receiver):
+        """
+        Номер кадра для каждого пакета: кадр начинается с пакета и забирает следующие
+        пакеты других приемников в пределах match_window_ms, по одному от приемника
+        """
+        frame = np.empty(len(ts), dtype=np.int64)
+        current, start, seen = -1, 0, 0
+        for i, (t, r) in enumerate(zip(ts.tolist(), receiver.tolist())):
+            bit = 1 << r
+            if current < 0 or t - start > self.match_window_us or seen & bit:
+                current += 1
+                start, seen = t, 0
+            seen |= bit
+            frame[i] = current
+        return frame
+
+    def calculate_distribution(self, df):
+        """
+        Пакеты разных приемников одного кадра (match_frames) сводятся в одну запись.
+        Положение кадра - центр позиций приемников с весами по мощности сигнала
+        (мВт над полом -100 dBm), зона - треть автобуса. Noise - если даже самый
+        сильный прием не сильнее порога front.
+        """
+        if 'receiver' not in df.columns or len(df) == 0:
+            return super().calculate_distribution(df)
+
+        df = df.sort_values('datetime', kind='stable')
+        ts = df['datetime'].to_numpy('datetime64[us]').astype(np.int64)
+        receiver = df['receiver'].to_numpy()
+        frame = self.match_frames(ts, receiver)
+        new_frame = np.diff(frame, prepend=-1) > 0
+
+        strongest = np.full((frame[-1] + 1, len(self.receivers)), RSSI_FLOOR, dtype=np.int64)
+        strongest[frame, receiver] = df['rssi'].to_numpy()
+
+        power = 10.0 ** ((strongest - RSSI_FLOOR) / 10) - 1
+        total = power.sum(axis=1)
+        positions = np.array([r.position for r in self.receivers], dtype=float)
+        position = np.divide(power @ positions, total, out=np.zeros_like(total), where=total > 0)
+        best = strongest.max(axis=1)
+
+        level = np.digitize(position, [1 / 3, 2 / 3])
+        level = np.where(best > self.location_thresholds['front'], level, -1)
+
+        return pd.DataFrame({
+            'datetime': df['datetime'].to_numpy()[new_frame],
+            'rssi': best,
+            'position': position,
+            'receivers': (strongest > RSSI_FLOOR).sum(axis=1),
+            'location_level': level,
+            'location_label': ZONE_LABELS[level],
+        })
+
+
+def parse_receivers(spec):
+    """'/dev/ttyUSB0:0,/dev/ttyUSB1:0.5,/dev/ttyUSB2:1' -> [(порт, положение)]"""
+    receivers = []
+    for part in spec.split(','):
+        port, position = part.rsplit(':', 1)
+        receivers.append((port.strip(), float(position)))
+    return receivers
+
+
+def main():
+    receivers = parse_receivers(os.getenv('RECEIVERS', '/dev/ttyUSB0:0,/dev/ttyUSB1:0.5,/dev/ttyUSB2:1'))
+    analyzer = MultiReceiverAnalyzer(receivers, output_dir='results',
+                                     capture_retention_bytes=int(os.getenv('CAPTURE_RETENTION_MB', 1024)) * 2**20)
+
+    analyzer.run_continuous_analysis(collection_minutes=2)
+
+if __name__ == "__main__":
+    main()
@@ -15,29 +15,74 @@ import serial
 import serial.tools.list_ports
 import threading
 import time
-import queue
 import os
+import cProfile
+from contextlib import contextmanager, nullcontext
+
+from capture_log import CaptureLog, to_dataframe
+from edge_agent import EdgeAgent, rssi_summary_rows
+
+EPOCH = datetime(1970, 1, 1)
 
 class BusDistributionAnalyzer:
-    def __init__(self, com_port='/dev/ttyUSB0', baudrate=115200, output_dir='results'):
+    def __init__(self, com_port='/dev/ttyUSB0', baudrate=115200, output_dir='results',
+                 capture_dir=None, segment_bytes=16 * 2**20, capture_retention_bytes=2**30):
         self.com_port = com_port
         self.baudrate = baudrate
         self.output_dir = output_dir
         self.serial_connection = None
-        self.data_queue = queue.Queue()
         self.df = pd.DataFrame(columns=['datetime', 'rssi'])
         self.is_collecting = False
         self.collection_thread = None
+        self.stage_timings = {}
+        self.counters = self._new_counters()
+        self.edge_agent = None  # EdgeAgent: сводки циклов уходят на сервер через очередь на диске
         
         # Создаем директорию для результатов
         os.makedirs(self.output_dir, exist_ok=True)
         
+        # Сырые пакеты пишутся сразу на диск и переживают падение посреди цикла
+        self.capture = CaptureLog(capture_dir or os.path.join(self.output_dir, 'capture'), segment_bytes,
+                                  capture_retention_bytes)
+        self.cycle_start_position = self.capture.position()
+        
         self.location_thresholds = {
             'back': -50,
             'middle': -65,
             'front': -85
         }
         
+    @staticmethod
+    def _new_counters():
+        return {
+            'packets_parsed': 0,
+            'lines_rejected': 0,
+            'service_lines': 0,
+            'serial_bytes': 0,
+            'serial_backlog_max': 0,
+        }
+
+    @contextmanager
+    def _stage(self, name):
+        """Суммирует время этапа в self.stage_timings (секунды)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[name] = self.stage_timings.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def _profile(self, cycle_count):
+        """cProfile обработки цикла в profile_cycle_N.prof; профилировщик выключается при любом выходе"""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{self.output_dir}/profile_cycle_{cycle_count}.prof")
+            print(f"Профиль сохранен: {self.output_dir}/profile_cycle_{cycle_count}.prof")
+
     def connect_serial(self):
         try:
             self.serial_connection = serial.Serial(
@@ -60,9 +105,11 @@ class BusDistributionAnalyzer:
         self.collection_duration = collection_minutes
         
         self.df = pd.DataFrame(columns=['datetime', 'rssi'])
-        self.data_queue = queue.Queue()
+        self.counters = self._new_counters()
+        self.cycle_start_position = self.capture.position()
         
-        self.collection_thread = threading.Thread(target=self._read_serial_data)
+        # Имя потока видно в py-spy dump/top
+        self.collection_thread = threading.Thread(target=self._read_serial_data, name='serial-reader')
         self.collection_thread.daemon = True
         self.collection_thread.start()
         
@@ -73,15 +120,21 @@ class BusDistributionAnalyzer:
         buffer = ""
         while self.is_collecting:
             try:
-                if self.serial_connection.in_waiting > 0:
-                    data = self.serial_connection.read(self.serial_connection.in_waiting).decode('utf-8', errors='ignore')
-                    buffer += data
+                waiting = self.serial_connection.in_waiting
+                if waiting > 0:
+                    # Сколько байт скопилось в буфере порта с прошлого чтения: у размера буфера
+                    # драйвера (обычно 4 КБ) чтение не успевает и пакеты теряются
+                    self.counters['serial_backlog_max'] = max(self.counters['serial_backlog_max'], waiting)
+                    raw = self.serial_connection.read(waiting)
+                    self.counters['serial_bytes'] += len(raw)
+                    buffer += raw.decode('utf-8', errors='ignore')
                     
                     while '\n' in buffer:
                         line, buffer = buffer.split('\n', 1)
                         line = line.strip()
                         if line:
                             self._process_data_line(line)
+                    self.capture.flush()
                 
                 if (datetime.now() - self.collection_start_time).total_seconds() >= self.collection_duration * 60:
                     self.is_collecting = False
@@ -101,13 +154,16 @@ class BusDistributionAnalyzer:
                 line.startswith("ERROR:") or
                 line.startswith("E (") or  # Пропускаем ошибки WiFi
                 "wifi:failed to post WiFi event" in line):
+                self.counters['service_lines'] += 1
                 return
                 
             if ',' in line:
                 parts = line.split(',')
-                if len(parts) == 2:
+                # timestamp,rssi[,channel]
+                if len(parts) in (2, 3):
                     timestamp_str = parts[0].strip()
                     rssi_str = parts[1].strip()
+                    channel = int(parts[2]) if len(parts) == 3 else 0
                     
                     try:
                         # Конвертируем timestamp из миллисекунд в datetime
@@ -119,51 +175,40 @@ class BusDistributionAnalyzer:
                     
                     rssi = int(rssi_str)
                     
-                    new_data = pd.DataFrame({
-                        'datetime': [dt],
-                        'rssi': [rssi]
-                    })
-                    
-                    # Исправляем предупреждение pandas
-                    if not self.df.empty:
-                        self.df = pd.concat([self.df, new_data], ignore_index=True)
-                    else:
-                        self.df = new_data.copy()
-                        
-                    self.data_queue.put(new_data)
+                    self._capture_packet(dt, rssi, channel)
+                else:
+                    self.counters['lines_rejected'] += 1
                     
             else:
                 # Если только RSSI значение (старый формат)
                 rssi = int(line.strip())
-                new_data = pd.DataFrame({
-                    'datetime': [datetime.now()],
-                    'rssi': [rssi]
-                })
-                
-                # Исправляем предупреждение pandas
-                if not self.df.empty:
-                    self.df = pd.concat([self.df, new_data], ignore_index=True)
-                else:
-                    self.df = new_data.copy()
-                    
-                self.data_queue.put(new_data)
+                self._capture_packet(datetime.now(), rssi, 0)
                 
         except ValueError:
             # Тихий пропуск некорректных данных (не выводим сообщение)
-            pass
+            self.counters['lines_rejected'] += 1
         except Exception as e:
             # Тихий пропуск других ошибок
-            pass
+            self.counters['lines_rejected'] += 1
+    
+    def _capture_packet(self, dt, rssi, channel):
+        # Время хранится как есть (локальное), в микросекундах от 1970-01-01
+        self.capture.append((dt - EPOCH) // timedelta(microseconds=1), rssi, channel)
+        self.counters['packets_parsed'] += 1
     
     def wait_for_collection_complete(self):
         if self.collection_thread:
             self.collection_thread.join()
+        # Данные цикла читаются из сегментов без промежуточных копий
+        self.capture.flush()
+        self.df = to_dataframe(self.capture.read_range(self.cycle_start_position))
         print(f"Сбор данных завершен. Собрано {len(self.df)} измерений")
     
     def stop_data_collection(self):
         self.is_collecting = False
         if self.serial_connection:
             self.serial_connection.close()
+        self.capture.close()
     
     def filter_short_stops(self, min_stop_duration=1):
         if self.df is None or len(self.df) == 0:
@@ -318,7 +363,8 @@ class BusDistributionAnalyzer:
             return
         
         print("Группировка пакетов по устройствам...")
-        unique_devices = self.group_similar_devices(valid_signals)
+        with self._stage('group_similar_devices'):
+            unique_devices = self.group_similar_devices(valid_signals)
         
         print(f"Всего пакетов: {len(valid_signals)}")
         print(f"Уникальных устройств: {len(unique_devices)}")
@@ -344,9 +390,10 @@ class BusDistributionAnalyzer:
         
         # Сохраняем график
         filename = f"{self.output_dir}/devices_per_minute_cycle_{cycle_count}.png"
-        plt.tight_layout()
-        plt.savefig(filename, dpi=300, bbox_inches='tight')
-        plt.close()
+        with self._stage('render_devices_per_minute'):
+            plt.tight_layout()
+            plt.savefig(filename, dpi=300, bbox_inches='tight')
+            plt.close()
         print(f"График сохранен: {filename}")
     
     def plot_distribution_analysis(self, df, cycle_count):
@@ -382,9 +429,10 @@ class BusDistributionAnalyzer:
         
         # Сохраняем основной график
         filename = f"{self.output_dir}/distribution_analysis_cycle_{cycle_count}.png"
-        plt.tight_layout()
-        plt.savefig(filename, dpi=300, bbox_inches='tight')
-        plt.close()
+        with self._stage('render_distribution_analysis'):
+            plt.tight_layout()
+            plt.savefig(filename, dpi=300, bbox_inches='tight')
+            plt.close()
         print(f"График распределения сохранен: {filename}")
         
         self.plot_total_devices_per_minute(df, cycle_count)
@@ -434,8 +482,31 @@ class BusDistributionAnalyzer:
         ax.set_title(f'Bus Signal Distribution', fontweight='bold')
         ax.axis('off')
     
-    def run_continuous_analysis(self, collection_minutes=1, cycles=None):
+    def save_cycle_timings(self, cycle_count, cycle_start):
+        """Время этапов (секунды) и счетчики цикла рядом с summary_stats_cycle_N.csv"""
+        record = {
+            'cycle': cycle_count,
+            'start_time': cycle_start.strftime('%Y-%m-%d %H:%M:%S'),
+            'total_s': (datetime.now() - cycle_start).total_seconds(),
+        }
+        record.update({f'{name}_s': round(seconds, 6) for name, seconds in self.stage_timings.items()})
+        record.update(self.counters)
+
+        filename = f"{self.output_dir}/timing_cycle_{cycle_count}.csv"
+        pd.DataFrame([record]).to_csv(filename, index=False)
+        slowest = max(self.stage_timings.items(), key=lambda x: x[1], default=None)
+        if slowest:
+            print(f"Тайминги сохранены: {filename} (дольше всего: {slowest[0]}, {slowest[1]:.2f} с)")
+
+    def run_continuous_analysis(self, collection_minutes=1, cycles=None, profile_cycles=()):
+        """
+        profile_cycles - номера циклов, обработка которых профилируется cProfile: результат в
+        profile_cycle_N.prof. Профилировщик один и только в основном потоке (с Python 3.12 второй
+        cProfile в другом потоке не включится); поток чтения порта смотреть через py-spy по PID
+        из лога: py-spy record --pid <PID>
+        """
         cycle_count = 0
+        print(f"PID анализатора: {os.getpid()}")
         
         try:
             while True:
@@ -446,24 +517,40 @@ class BusDistributionAnalyzer:
                 print(f"\nЦикл анализа #{cycle_count}")
                 print("-" * 50)
                 
-                # ИСПРАВЛЕНО: Убедимся что передается правильное время
-                if not self.start_data_collection(collection_minutes):
-                    break
+                cycle_start = datetime.now()
+                self.stage_timings = {}
                 
-                self.wait_for_collection_complete()
+                # ИСПРАВЛЕНО: Убедимся что передается правильное время
+                with self._stage('collection'):
+                    if not self.start_data_collection(collection_minutes):
+                        break
+                    
+                    self.wait_for_collection_complete()
                 
                 if len(self.df) == 0:
                     print("Данные не получены. Пропускаем цикл.")
+                    self.save_cycle_timings(cycle_count, cycle_start)
                     continue
                 
-                df_filtered = self.filter_short_stops()
-                df_processed = self.calculate_distribution(df_filtered if df_filtered is not None else self.df)
+                with self._profile(cycle_count) if cycle_count in profile_cycles else nullcontext():
+                    with self._stage('filter_short_stops'):
+                        df_filtered = self.filter_short_stops()
+                    with self._stage('calculate_distribution'):
+                        df_processed = self.calculate_distribution(df_filtered if df_filtered is not None else self.df)
+                
+                    # СОХРАНЕНИЕ ДАННЫХ В ТАБЛИЦУ
+                    with self._stage('save_data_to_csv'):
+                        self.save_data_to_csv(df_processed, cycle_count)
+                        if self.edge_agent:
+                            self.edge_agent.put_rssi_summary(rssi_summary_rows(df_processed))
                 
-                # СОХРАНЕНИЕ ДАННЫХ В ТАБЛИЦУ
-                self.save_data_to_csv(df_processed, cycle_count)
+                    with self._stage('generate_summary'):
+                        self.generate_summary(df_processed, cycle_count)
+                    # включает group_similar_devices и render_* ниже
+                    with self._stage('plots'):
+                        self.plot_distribution_analysis(df_processed, cycle_count)
                 
-                self.generate_summary(df_processed, cycle_count)
-                self.plot_distribution_analysis(df_processed, cycle_count)
+                self.save_cycle_timings(cycle_count, cycle_start)
                 
                 print(f"\nЦикл #{cycle_count} завершен. Ожидание следующего цикла...")
                 time.sleep(2)
@@ -472,11 +559,22 @@ class BusDistributionAnalyzer:
             print("\nАнализ остановлен пользователем")
         finally:
             self.stop_data_collection()
+            if self.edge_agent:
+                self.edge_agent.stop()
 
 def main():
-    analyzer = BusDistributionAnalyzer(com_port='/dev/ttyUSB0', output_dir='results')
+    analyzer = BusDistributionAnalyzer(com_port='/dev/ttyUSB0', output_dir='results',
+                                       capture_retention_bytes=int(os.getenv('CAPTURE_RETENTION_MB', 1024)) * 2**20)
+    
+    # Например PROFILE_CYCLES=3 - профилировать третий цикл
+    profile_cycles = {int(x) for x in os.getenv('PROFILE_CYCLES', '').split(',') if x.strip()}
     
-    analyzer.run_continuous_analysis(collection_minutes=2)
+    # Например EDGE_SERVER_URL=http://server:1338 BUS_NUM=228 - отправлять сводки на сервер
+    if os.getenv('EDGE_SERVER_URL'):
+        analyzer.edge_agent = EdgeAgent(os.getenv('EDGE_SERVER_URL'), os.getenv('BUS_NUM', '0'),
+                                        outbox_dir=os.path.join(analyzer.output_dir, 'outbox'))
+        analyzer.edge_agent.start()
+    analyzer.run_continuous_analysis(collection_minutes=2, profile_cycles=profile_cycles)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Synthetic RSSI stream generator
+- Поток probe request пакетов в формате приемника ESP32 (datetime, rssi)
+- Распределение RSSI и интервалы внутри пачек берутся из res/bus_evening.csv
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'res', 'bus_evening.csv')
+START_TIME = pd.Timestamp('2025-10-04 20:00:00')
+
+# Запасной профиль, если файла с записью нет: квантили RSSI из bus_evening.csv
+FALLBACK_RSSI = np.array([-97, -94, -92, -91, -90, -89, -88, -86, -84, -80,
+                          -74, -66, -62, -58, -55, -52, -48, -44, -39])
+FALLBACK_BURST_GAP_S = 0.011
+
+
+def load_profile(path=PROFILE_PATH):
+    """Значения RSSI и медианный интервал между пакетами одной пачки из реальной записи"""
+    if not os.path.exists(path):
+        return FALLBACK_RSSI, FALLBACK_BURST_GAP_S
+
+    df = pd.read_csv(path, parse_dates=['datetime'])
+    gaps = df['datetime'].diff().dt.total_seconds().dropna()
+    burst_gaps = gaps[gaps < 0.1]
+    burst_gap = float(burst_gaps.median()) if len(burst_gaps) else FALLBACK_BURST_GAP_S
+    return df['rssi'].to_numpy(), burst_gap
+
+
+def parse_stops(pattern):
+    """'90:40,20:40' -> [(90, 40), (20, 40)]: секунды записи и следующей за ней тишины, по кругу"""
+    stops = []
+    for part in pattern.split(','):
+        active, silent = part.split(':')
+        stops.append((float(active), float(silent)))
+    return stops
+
+
+def generate_stream(packets, pps=4.0, devices=30, stops='90:40,20:40', burst_max=5, seed=0, profile=None):
+    """
+    DataFrame(datetime, rssi) из `packets` пакетов.
+    - `devices` телефонов, у каждого свой базовый RSSI (место в салоне) из профиля
+    - телефон шлет пачки из 1..`burst_max` пакетов, в среднем `pps` пакетов в секунду записи
+    - `stops` задает чередование записи и тишины; тишина > 30 с разбивает запись
+      на группы, как в filter_short_stops
+    """
+    rng = np.random.default_rng(seed)
+    rssi_profile, burst_gap = profile if profile is not None else load_profile()
+
+    # Пачки: размер, владелец и начало во "времени записи" (без пауз)
+    mean_burst = (1 + burst_max) / 2
+    bursts = int(np.ceil(packets / mean_burst * 1.1)) + 10 * burst_max
+    sizes = rng.integers(1, burst_max + 1, bursts)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), packets) + 1]
+    sizes[-1] -= sizes.sum() - packets
+    active_total = packets / pps
+    starts = np.sort(rng.uniform(0, active_total, len(sizes)))
+    owners = rng.integers(0, devices, len(sizes))
+
+    # Разворачиваем пачки в пакеты
+    burst_index = np.repeat(np.arange(len(sizes)), sizes)
+    offset_in_burst = np.arange(packets) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    jitter = rng.exponential(burst_gap, packets)
+    active_time = starts[burst_index] + offset_in_burst * burst_gap + np.where(offset_in_burst > 0, jitter, 0)
+    order = np.argsort(active_time, kind='stable')
+    active_time, burst_index = active_time[order], burst_index[order]
+
+    # Переводим время записи в реальное, вставляя паузы по шаблону остановок
+    cycle = parse_stops(stops)
+    cycle_active = sum(active for active, _ in cycle)
+    cycle_total = sum(active + silent for active, silent in cycle)
+    full_cycles, rest = np.divmod(active_time, cycle_active)
+    wall_time = full_cycles * cycle_total
+    active_edges = np.cumsum([0] + [active for active, _ in cycle])
+    silence_before = np.cumsum([0] + [silent for _, silent in cycle])
+    segment = np.clip(np.searchsorted(active_edges, rest, side='right') - 1, 0, len(cycle) - 1)
+    wall_time += rest + silence_before[segment]
+
+    base_rssi = rng.choice(rssi_profile, devices)
+    rssi = base_rssi[owners[burst_index]] + rng.normal(0, 2, packets)
+
+    return pd.DataFrame({
+        'datetime': START_TIME + pd.to_timedelta(wall_time, unit='s'),
+        'rssi': np.clip(np.round(rssi), -100, -30).astype(np.int64),
+    })
+
+
+def to_serial_lines(df):
+    """Те же пакеты в виде строк 'millis,rssi', как их печатает rssi_search.ino"""
+    millis = ((df['datetime'] - df['datetime'].iloc[0]).dt.total_seconds() * 1000).astype(np.int64)
+    return [f'{ms},{rssi}\n' for ms, rssi in zip(millis, df['rssi'])]
+
+
+if __name__ == "__main__":
+    print(generate_stream(1000).describe())
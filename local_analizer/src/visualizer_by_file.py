@@ -9,6 +9,9 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import timedelta
+import os
+
+from capture_log import SEGMENT_SUFFIX, load_dataframe
 
 class BusDistributionAnalyzer:
     def __init__(self, filename):
@@ -26,7 +29,11 @@ class BusDistributionAnalyzer:
     def load_data(self):
         """Загрузка данных из файла"""
         try:
-            if self.filename.endswith('.csv'):
+            if self.filename.endswith(SEGMENT_SUFFIX) or os.path.isdir(self.filename):
+                # Сегменты capture log из pars_vis: файл или весь каталог capture
+                self.df = load_dataframe(self.filename)
+                
+            elif self.filename.endswith('.csv'):
                 self.df = pd.read_csv(self.filename)
                 if 'datetime' in self.df.columns and 'rssi' in self.df.columns:
                     self.df['datetime'] = pd.to_datetime(self.df['datetime'])
@@ -0,0 +1,196 @@
+import os
+import time
+from collections import deque
+
+
+# Shared state for services that run as several workers/replicas.
+# STATE_BACKEND_URL=memory:// (default) keeps it in the process, which is only
+# correct for a single worker; redis://host:port/db works with Redis or any
+# Redis-compatible server (Valkey, KeyDB, Dragonfly, ...).
+#
+# Every service is its own docker build context, so each has a copy of this
+# file. The copies must stay identical (tests/test_backend.py checks it): change
+# them all together, even for a method only one service uses.
+
+TOKEN_BUCKET_LUA = '''
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local ok = 0
+if tokens - 1 >= reserve then
+    tokens = tokens - 1
+    ok = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+return {ok, tostring(tokens)}
+'''
+
+RETURN_TOKEN_LUA = '''
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + 1)))
+end
+'''
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    async def get(self, key: str) -> bytes | None:
+        return self.data[key] if self._alive(key) else None
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None):
+        self.data[key] = value
+        if ttl is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.monotonic() + ttl
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        '''Sets the key only if it does not exist; True if it was set'''
+        if self._alive(key):
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self.data.pop(key, None)
+        self.expires.pop(key, None)
+
+    async def keys(self, prefix: str) -> list[str]:
+        return [key for key in list(self.data) if key.startswith(prefix) and self._alive(key)]
+
+    async def update(self, key: str, fn, ttl: float | None = None):
+        '''Atomic read-modify-write: fn(old value or None) -> (new value, result); returns result'''
+        value, result = fn(await self.get(key))  # no await in between, so no other task interleaves
+        await self.set(key, value, ttl)
+        return result
+
+    async def push(self, key: str, values: list[bytes], maxlen: int):
+        '''Appends to a list that keeps only the last `maxlen` values'''
+        self.data.setdefault(key, deque(maxlen=maxlen)).extend(values)
+
+    async def tail(self, key: str, limit: int) -> list[bytes]:
+        return list(self.data.get(key, ()))[-limit:]
+
+    async def hincr(self, key: str, amounts: dict[str, float]):
+        fields = self.data.setdefault(key, {})
+        for field, amount in amounts.items():
+            fields[field] = fields.get(field, 0.0) + amount
+
+    async def hgetall(self, key: str) -> dict[str, float]:
+        return dict(self.data.get(key, {}))
+
+    async def take_token(self, key: str, capacity: float, rate: float, reserve: float = 0) -> tuple[bool, float]:
+        '''Token bucket: (taken?, tokens left)'''
+        now = time.monotonic()
+        tokens, updated = self.data.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        ok = tokens - 1 >= reserve
+        if ok:
+            tokens -= 1
+        self.data[key] = (tokens, now)
+        return ok, tokens
+
+    async def return_token(self, key: str, capacity: float):
+        '''Gives back a token taken for work that was not done'''
+        if key in self.data:
+            tokens, updated = self.data[key]
+            self.data[key] = (min(capacity, tokens + 1), updated)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.watch_error = redis.WatchError
+        self.token_bucket = self.redis.register_script(TOKEN_BUCKET_LUA)
+        self.token_return = self.redis.register_script(RETURN_TOKEN_LUA)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None):
+        await self.redis.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        return bool(await self.redis.set(key, value, px=int(ttl * 1000) if ttl is not None else None, nx=True))
+
+    async def delete(self, key: str):
+        await self.redis.delete(key)
+
+    async def keys(self, prefix: str) -> list[str]:
+        return [key.decode() async for key in self.redis.scan_iter(match=f'{prefix}*')]
+
+    async def update(self, key: str, fn, ttl: float | None = None):
+        '''
+        Atomic read-modify-write with WATCH/MULTI: fn(old value or None) -> (new value, result).
+        If another client writes the key in between, fn runs again on the new value.
+        '''
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    value, result = fn(await pipe.get(key))
+                    pipe.multi()
+                    pipe.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+                    await pipe.execute()
+                    return result
+                except self.watch_error:
+                    continue
+
+    async def push(self, key: str, values: list[bytes], maxlen: int):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *values)
+            pipe.ltrim(key, -maxlen, -1)
+            await pipe.execute()
+
+    async def tail(self, key: str, limit: int) -> list[bytes]:
+        return await self.redis.lrange(key, -limit, -1)
+
+    async def hincr(self, key: str, amounts: dict[str, float]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for field, amount in amounts.items():
+                pipe.hincrbyfloat(key, field, amount)
+            await pipe.execute()
+
+    async def hgetall(self, key: str) -> dict[str, float]:
+        return {k.decode(): float(v) for k, v in (await self.redis.hgetall(key)).items()}
+
+    async def take_token(self, key: str, capacity: float, rate: float, reserve: float = 0) -> tuple[bool, float]:
+        ok, tokens = await self.token_bucket(keys=[key], args=[capacity, rate, reserve])
+        return bool(ok), float(tokens)
+
+    async def return_token(self, key: str, capacity: float):
+        await self.token_return(keys=[key], args=[capacity])
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def make_backend(url: str | None = None):
+    url = url or os.getenv('STATE_BACKEND_URL', 'memory://')
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f'Unknown state backend: {url}')
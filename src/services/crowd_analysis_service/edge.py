@@ -0,0 +1,98 @@
+import json
+import zlib
+from itertools import accumulate
+
+from models import FleetBus
+
+
+# Bulk uploads from the edge agent on the bus (local_analizer/src/edge_agent.py).
+# A batch is gzip'd NDJSON; every line is either
+#   {"type": "frame", "bus_num", "taken_at", "image": {...proc_image fields}}
+#   {"type": "rssi", "bus_num", "fields": [...], "encoding": "delta", "rows": [[...], ...]}
+# Frames of one bus with the same taken_at make up one snapshot.
+
+BATCH_PREFIX = 'crowd:batch:'
+RSSI_PREFIX = 'crowd:rssi:'
+PENDING = b'pending'
+DONE = b'done'
+
+
+class BatchTooLarge(ValueError):
+    pass
+
+
+def gunzip(body: bytes, limit: int) -> bytes:
+    '''Decompresses at most `limit` bytes, so a small gzip bomb cannot exhaust memory'''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, limit + 1)
+    if len(data) > limit:
+        raise BatchTooLarge(f'Batch is larger than {limit} bytes uncompressed')
+    if not decompressor.eof:
+        raise ValueError('Truncated gzip body')
+    return data
+
+
+def read_batch(body: bytes, content_encoding: str | None, limit: int) -> list[dict]:
+    if content_encoding == 'gzip' or body[:2] == b'\x1f\x8b':
+        body = gunzip(body, limit)
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def delta_decode(record: dict) -> list[dict]:
+    '''Rows as dicts; with "delta" encoding every row after the first holds differences to the previous one'''
+    rows = record['rows']
+    if record.get('encoding') == 'delta' and rows:
+        columns = [list(accumulate(column)) for column in zip(*rows)]
+        rows = list(zip(*columns))
+    return [dict(zip(record['fields'], row)) for row in rows]
+
+
+def snapshots(records: list[dict]) -> list[FleetBus]:
+    grouped: dict[tuple, list] = {}
+    for record in records:
+        if record.get('type') == 'frame':
+            grouped.setdefault((record['bus_num'], record.get('taken_at')), []).append(record['image'])
+    return [
+        FleetBus(bus_num=bus_num, images=images, taken_at=taken_at)
+        for (bus_num, taken_at), images in grouped.items()
+    ]
+
+
+class BatchLedger:
+    '''
+    State of every X-Batch-Id in the shared backend, so a retried upload is not
+    analysed twice by any worker. A batch is claimed as pending while it is being
+    analysed (expiring after `pending_ttl` in case the worker dies) and marked done
+    only once it was accepted.
+    '''
+    def __init__(self, backend, pending_ttl: float = 600, done_ttl: float = 7 * 24 * 3600):
+        self.backend = backend
+        self.pending_ttl = pending_ttl
+        self.done_ttl = done_ttl
+
+    async def claim(self, batch_id: str) -> bytes | None:
+        '''None if this request now owns the batch, otherwise its state: PENDING or DONE'''
+        key = BATCH_PREFIX + batch_id
+        if await self.backend.set_if_absent(key, PENDING, ttl=self.pending_ttl):
+            return None
+        return await self.backend.get(key) or PENDING
+
+    async def done(self, batch_id: str):
+        await self.backend.set(BATCH_PREFIX + batch_id, DONE, ttl=self.done_ttl)
+
+    async def release(self, batch_id: str):
+        await self.backend.delete(BATCH_PREFIX + batch_id)
+
+
+class RssiHistory:
+    '''Last `size` RSSI summary rows per bus, in the shared backend'''
+    def __init__(self, backend, size: int = 1440):
+        self.backend = backend
+        self.size = size
+
+    async def add(self, bus_num: str, rows: list[dict]):
+        if rows:
+            await self.backend.push(RSSI_PREFIX + bus_num, [json.dumps(row).encode() for row in rows], self.size)
+
+    async def get(self, bus_num: str, limit: int) -> list[dict]:
+        return [json.loads(row) for row in await self.backend.tail(RSSI_PREFIX + bus_num, limit)]
@@ -0,0 +1,66 @@
+import asyncio
+from collections import OrderedDict, deque
+
+
+class FairPool:
+    '''
+    Bounded pool of `size` workers shared by all requests. Work is queued per
+    key (bus_num) and workers take one item per key in turn, so a bus with
+    many cameras cannot starve the others.
+    '''
+    def __init__(self, size: int):
+        self.size = size
+        self.queues: OrderedDict[str, deque] = OrderedDict()
+        self.has_work = asyncio.Event()
+        self.workers: list[asyncio.Task] = []
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.size)]
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, key: str, factory) -> asyncio.Future:
+        '''Queues factory() under `key`; cancelling the future drops or cancels the work'''
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(key, deque()).append((factory, future))
+        self.has_work.set()
+        return future
+
+    def _next(self):
+        while self.queues:
+            key, queue = self.queues.popitem(last=False)
+            factory, future = queue.popleft()
+            if queue:
+                self.queues[key] = queue  # back of the line
+            if not future.cancelled():
+                return factory, future
+        self.has_work.clear()
+        return None
+
+    async def _worker(self):
+        while True:
+            await self.has_work.wait()
+            item = self._next()
+            if item is None:
+                continue
+            factory, future = item
+
+            task = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda f, task=task: task.cancel() if f.cancelled() else None)
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
@@ -0,0 +1,128 @@
+import json
+import time
+
+from models import CrowdAnalysisResponse
+
+
+# The backend is on the rider's path: on its errors both classes fall back to a cache
+# miss or to this worker's own view of the breaker rather than failing the request
+LAST_KNOWN_PREFIX = 'crowd:last:'
+REFRESH_PREFIX = 'crowd:refresh:'
+BREAKER_KEY = 'crowd:breaker:opened_at'
+TRIAL_KEY = 'crowd:breaker:trial'
+
+
+class LastKnown:
+    '''
+    Last successful analysis per bus_num with the time it was made, in the shared
+    backend; kept for `ttl` seconds, after which it is too old to be served anyway
+    '''
+    def __init__(self, backend, ttl: float = 900):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def put(self, bus_num: str, result: CrowdAnalysisResponse, updated: float | None = None):
+        updated = time.time() if updated is None else updated
+        value = json.dumps({'result': result.model_dump(), 'updated': updated}).encode()
+
+        def newer(raw):
+            if raw and json.loads(raw)['updated'] > updated:
+                return raw, None  # a late upload of older frames keeps the newer result
+            return value, None
+
+        try:
+            await self.backend.update(LAST_KNOWN_PREFIX + bus_num, newer, ttl=self.ttl)
+        except Exception as e:
+            print(f'bus {bus_num}: last-known result not stored: {e}')
+
+    async def get(self, bus_num: str) -> tuple[CrowdAnalysisResponse, float] | None:
+        '''(result, age in seconds) or None'''
+        try:
+            raw = await self.backend.get(LAST_KNOWN_PREFIX + bus_num)
+        except Exception as e:
+            print(f'bus {bus_num}: last-known result not available: {e}')
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return CrowdAnalysisResponse.model_validate(entry['result']), max(0.0, time.time() - entry['updated'])
+
+    async def claim_refresh(self, bus_num: str, ttl: float) -> bool:
+        '''True if no worker is refreshing the bus yet; the claim lapses after `ttl` seconds'''
+        try:
+            return await self.backend.set_if_absent(REFRESH_PREFIX + bus_num, b'1', ttl=ttl)
+        except Exception:
+            return False  # without the backend nothing would be stored anyway
+
+    async def release_refresh(self, bus_num: str):
+        try:
+            await self.backend.delete(REFRESH_PREFIX + bus_num)
+        except Exception:
+            pass  # the claim lapses on its own
+
+
+class CircuitBreaker:
+    '''
+    Opens after `failures` consecutive upstream errors seen by a worker. The open
+    state lives in the shared backend, so all workers stop calling llm-service.
+    The decision is made once per request (admit): while open, requests are
+    refused; every `reset_s` one request over all workers is let through with
+    all of its frames (half-open), and its success closes the breaker again.
+    '''
+    def __init__(self, backend, failures: int = 5, reset_s: float = 30):
+        self.backend = backend
+        self.failures = failures
+        self.reset_s = reset_s
+        self.errors = 0
+        self.opened_at = None  # as last seen in the backend
+
+    async def _load(self) -> float | None:
+        try:
+            raw = await self.backend.get(BREAKER_KEY)
+        except Exception as e:
+            print(f'breaker state not available, using the local one: {e}')
+            return self.opened_at
+        self.opened_at = float(raw) if raw else None
+        return self.opened_at
+
+    async def state(self) -> str:
+        opened_at = await self._load()
+        if opened_at is None:
+            return 'closed'
+        return 'open' if time.time() - opened_at < self.reset_s else 'half_open'
+
+    async def admit(self) -> bool:
+        '''Whether a request may call llm-service; call once per request, not per frame'''
+        opened_at = await self._load()
+        if opened_at is None:
+            return True
+        if time.time() - opened_at < self.reset_s:
+            return False
+        # half-open: the first request of this window is the trial, the rest wait for the next one
+        try:
+            return await self.backend.set_if_absent(TRIAL_KEY, b'1', ttl=self.reset_s)
+        except Exception:
+            return True
+
+    async def success(self):
+        self.errors = 0
+        if self.opened_at is not None:
+            self.opened_at = None
+            print('llm-service recovered, circuit closed')
+            try:
+                await self.backend.delete(BREAKER_KEY)
+                await self.backend.delete(TRIAL_KEY)
+            except Exception as e:
+                print(f'breaker state not stored: {e}')
+
+    async def failure(self):
+        self.errors += 1
+        # a failed trial opens the breaker for another reset_s
+        if self.errors >= self.failures or self.opened_at is not None:
+            if self.opened_at is None:
+                print(f'llm-service failed {self.errors} times in a row, circuit open for {self.reset_s}s')
+            self.opened_at = time.time()
+            try:
+                await self.backend.set(BREAKER_KEY, str(self.opened_at).encode())
+            except Exception as e:
+                print(f'breaker state not stored: {e}')
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from collections import deque
+
+
+class LatencyTracker:
+    '''Rolling window of upstream latencies, used to pick the hedge delay'''
+    def __init__(self, size=200, percentile=0.95, default=5.0, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.percentile = percentile
+        self.default = default
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        if len(self.samples) < self.min_samples:
+            return self.default
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+
+async def hedged(call, delay: float, tracker: LatencyTracker | None = None):
+    '''
+    Runs call() and, if it has not finished after `delay` seconds, a duplicate
+    of it. Returns the first successful result and cancels the other attempt.
+    '''
+    async def timed():
+        start = time.monotonic()
+        result = await call()
+        if tracker is not None:
+            tracker.observe(time.monotonic() - start)
+        return result
+
+    # everything after the first task is created sits in the try, so a caller that
+    # is cancelled (deadline, pool shutdown) cancels the upstream calls too
+    tasks = {asyncio.ensure_future(timed())}
+    error = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.add(asyncio.ensure_future(timed()))
+
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
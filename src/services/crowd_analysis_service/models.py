@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Any
+from typing import Optional, Any, List, Literal
 
 
 class Image(BaseModel):
@@ -10,3 +10,64 @@ class Image(BaseModel):
 
 class ProcRequest(BaseModel):
     images: list[dict[str, Any]]
+    deadline_ms: Optional[int] = Field(None, description="Latency budget; frames not processed by then are left out")
+    bus_num: Optional[str] = Field(None, description="Key of the last-known result, defaults to bus_num of the images")
+
+# mirrors llm_service/models.py: the contract of /api/v1/proc_image
+Priority = Literal['high', 'low']
+
+class BusAnalysisResponse(BaseModel):
+    load: str
+    people_num: int
+    free_entrance: List[int]
+    free_seats: int
+
+class ProcResponse(BaseModel):
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    timestamp: Optional[int] = None
+    bus_num: Optional[str] = None
+    cam_num: Optional[int] = None
+    cam_info: Optional[str] = None
+    gate_pos: Optional[list[int] | int] = None
+    proc_data: BusAnalysisResponse
+
+class CrowdAnalysisResponse(BaseModel):
+    seats: int
+    people: int
+    free_entrance: int
+    included_cams: list[Optional[int]] = Field(default_factory=list, description="Cameras the result is based on")
+    failed_cams: list[Optional[int]] = Field(default_factory=list, description="Cameras whose frames failed or missed the deadline")
+    stale: bool = Field(False, description="Last-known result past its freshness, served while llm-service is refreshing or unavailable")
+    age_s: Optional[float] = Field(None, description="Seconds since the served result was made; None if made for this request")
+
+class FleetBus(BaseModel):
+    bus_num: str
+    images: list[dict[str, Any]]
+    taken_at: Optional[float] = Field(None, description="Unix time the frames were captured, defaults to now")
+
+class FleetRequest(BaseModel):
+    buses: list[FleetBus]
+    deadline_ms: Optional[int] = Field(None, description="Latency budget for the whole snapshot")
+    priority: Priority = Field('low', description="Priority of the frames in llm-service; a snapshot of many buses is batch work")
+
+class FleetBusResult(BaseModel):
+    bus_num: str
+    result: Optional[CrowdAnalysisResponse] = None
+    error: Optional[str] = None
+
+class NearbyBus(BaseModel):
+    bus_num: str
+    lat: float
+    lon: float
+    free_seats: int
+    load: Optional[str] = None
+    age_s: float = Field(description="Seconds since the last analysis of this bus")
+    distance_m: float
+
+class EdgeIngestResponse(BaseModel):
+    batch_id: Optional[str] = None
+    duplicate: bool = False
+    frames: int = 0
+    rssi_rows: int = 0
+    results: list[FleetBusResult] = Field(default_factory=list)
@@ -1,24 +1,124 @@
-import json
-from fastapi import FastAPI, HTTPException
+import time
+STARTED = time.monotonic()
+
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 
-import numpy as np
-import requests
 from collections import Counter
+from statistics import fmean
 
 from math import ceil
 
 import httpx
 import asyncio
+import os
+import zlib
 
 from models import *
+from hedging import LatencyTracker, hedged
+from fleet import FairPool
+from spatial import LOAD_LEVELS, make_bus_index
+from edge import DONE, BatchLedger, BatchTooLarge, RssiHistory, delta_decode, read_batch, snapshots
+from backend import make_backend
+from freshness import CircuitBreaker, LastKnown
 
 
 import uvicorn
 
 
+LLM_SERVICE_URL = os.getenv('LLM_SERVICE_URL', 'http://llm-service:1337/api/v1/proc_image')
+LLM_SERVICE_READY_URL = str(httpx.URL(LLM_SERVICE_URL).join('/ready'))
+DEFAULT_DEADLINE_MS = int(os.getenv('CROWD_DEADLINE_MS', 20000))
+
+# hedge a frame with a duplicate request once it is slower than p95 of recent calls
+latency = LatencyTracker(
+    percentile=float(os.getenv('HEDGE_PERCENTILE', 0.95)),
+    default=float(os.getenv('HEDGE_DEFAULT_DELAY', 5)),
+)
+
+# one pooled client for all requests instead of a new connection per call;
+# created in lifespan, building its SSL context is the slowest part of startup
+client: httpx.AsyncClient = None
+
+# every per-image call of /fleet_analysis goes through this pool, round-robin by bus
+pool = FairPool(int(os.getenv('FLEET_CONCURRENCY', 32)))
+
+# shared by all workers (STATE_BACKEND_URL), see backend.py
+backend = make_backend()
+
+# last known position and occupancy per bus, fed by every finished analysis;
+# a Redis GEO set with a Redis backend, an in-process grid with memory://
+bus_index = make_bus_index(
+    backend,
+    cell_deg=float(os.getenv('BUS_INDEX_CELL_DEG', 0.005)),
+    max_age_s=float(os.getenv('BUS_INDEX_MAX_AGE', 600)),
+)
+
+# bulk uploads from edge agents: retried batches are recognised by X-Batch-Id
+batches = BatchLedger(backend)
+rssi_history = RssiHistory(backend)
+# compressed and uncompressed size cap of one batch
+EDGE_MAX_BATCH_BYTES = int(os.getenv('EDGE_MAX_BATCH_MB', 64)) * 2**20
+
+# last successful result per bus_num, shared by all workers: within CROWD_FRESH_S it is
+# served as is, up to CROWD_REVALIDATE_S it is served as stale while a background call
+# refreshes it, and up to CROWD_MAX_STALE_S it stands in for llm-service when that fails
+# or the breaker is open
+FRESH_S = float(os.getenv('CROWD_FRESH_S', 10))
+REVALIDATE_S = float(os.getenv('CROWD_REVALIDATE_S', 120))
+MAX_STALE_S = float(os.getenv('CROWD_MAX_STALE_S', 900))
+last_known = LastKnown(backend, ttl=MAX_STALE_S)
+refreshing: set[asyncio.Task] = set()
+
+# stops calling llm-service after BREAKER_FAILURES errors in a row, retries every BREAKER_RESET_S
+breaker = CircuitBreaker(
+    backend,
+    failures=int(os.getenv('BREAKER_FAILURES', 5)),
+    reset_s=float(os.getenv('BREAKER_RESET_S', 30)),
+)
+
+status = {'warm': False, 'startup_s': None}
+
+# errors of a bus that say nothing about its frames: llm-service was down or the breaker open,
+# so the same snapshot can succeed later
+LLM_UNAVAILABLE = 'llm-service is unavailable'
+NOT_PROCESSED = 'None of the frontal images were processed'
+UPSTREAM_ERRORS = {LLM_UNAVAILABLE, NOT_PROCESSED}
+
+
+async def probe_upstream() -> bool:
+    try:
+        response = await client.get(LLM_SERVICE_READY_URL, timeout=5)
+        return response.status_code == 200
+    except httpx.HTTPError as e:
+        print(f'llm-service is not reachable: {e}')
+        return False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    client = httpx.AsyncClient(timeout=DEFAULT_DEADLINE_MS / 1000)
+    pool.start()
+    await probe_upstream()
+    status['warm'] = True
+    status['startup_s'] = time.monotonic() - STARTED
+    print(f"crowd-analysis-service started in {status['startup_s']:.2f}s")
+    yield
+    for task in refreshing:
+        task.cancel()
+    await pool.close()
+    await client.aclose()
+    await backend.close()
+
+
 crowd_analysys_service = FastAPI(
-    prefix='/api/v1'
+    prefix='/api/v1',
+    lifespan=lifespan,
 )
 
 crowd_analysys_service.add_middleware(
@@ -30,6 +130,20 @@ crowd_analysys_service.add_middleware(
 )
 
 
+@crowd_analysys_service.get('/health')
+async def health():
+    return {'status': 'ok', 'startup_s': status['startup_s']}
+
+
+@crowd_analysys_service.get('/ready')
+async def ready():
+    upstream_ok = status['warm'] and await probe_upstream()
+    return JSONResponse(
+        {'ready': upstream_ok, 'upstream_ok': upstream_ok, 'breaker': await breaker.state(), 'startup_s': status['startup_s']},
+        status_code=200 if upstream_ok else 503,
+    )
+
+
 def frontal_gated_images(req: ProcRequest):
     frontal, gate = [], []
 
@@ -42,63 +156,291 @@ def frontal_gated_images(req: ProcRequest):
     return frontal, gate
 
 
-async def get_processed_images(images: list[Image]):
-    async def fetch_url(client: httpx.AsyncClient, url, image):
-        print(image.keys())
-        response = await client.post(url, json=image)
-        return response.json()
-    async with httpx.AsyncClient() as client:
-        tasks = [fetch_url(client, 'http://llm-service:1337/api/v1/proc_image', image) for image in images]
-        results = await asyncio.gather(*tasks)
+async def process_image(image: dict, deadline: float) -> ProcResponse | None:
+    """Hedged call to llm-service; None if the frame could not be processed"""
+    async def fetch_url(url, image):
+        response = await client.post(url, json=image, timeout=deadline)
+        response.raise_for_status()
+        return ProcResponse.model_validate_json(response.content)
+
+    try:
+        result = await hedged(
+            lambda: fetch_url(LLM_SERVICE_URL, image),
+            latency.hedge_delay(),
+            latency,
+        )
+    except (httpx.HTTPError, ValidationError) as e:
+        print(f"cam {image.get('cam_num')}: {e}")
+        # a rejected frame (4xx) says nothing about the health of llm-service
+        if not (isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500):
+            await breaker.failure()
+        return None
+    await breaker.success()
+    return result
+
+
+async def get_processed_images(images: list[Image], deadline: float) -> list[ProcResponse | None]:
+    """Results in the order of `images`; None for frames that failed or missed the deadline"""
+    if not images:
+        return []
+
+    tasks = [asyncio.ensure_future(process_image(image, deadline)) for image in images]
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+
+    return [task.result() if task in done else None for task in tasks]
+
+
+def aggregate(frontal: list[ProcResponse], gate: list[ProcResponse]) -> tuple[int, int, int]:
+    seats = fmean(x.proc_data.free_seats for x in frontal)
+
+    people = fmean(x.proc_data.people_num for x in frontal)
+    if gate:
+        people += 1.5 * fmean(x.proc_data.people_num for x in gate)
+
+    entrances = Counter(e for x in frontal + gate for e in x.proc_data.free_entrance)
+    free_entr = entrances.most_common(1)[0][0] if entrances else 0
+
+    return int(ceil(seats)), int(ceil(people)), free_entr
+
+
+def summarize(frontal: list[dict], gate: list[dict], processed: list[ProcResponse | None]) -> CrowdAnalysisResponse:
+    """`processed` holds the results for frontal + gate, in that order"""
+    included_cams, failed_cams = [], []
+    for image, result in zip(frontal + gate, processed):
+        (failed_cams if result is None else included_cams).append(image.get('cam_num'))
+
+    frontal_processed = [x for x in processed[:len(frontal)] if x is not None]
+    gate_processed = [x for x in processed[len(frontal):] if x is not None]
+
+    if not frontal_processed:
+        raise HTTPException(502, NOT_PROCESSED)
+
+    seats, people, free_entr = aggregate(frontal_processed, gate_processed)
+
+    return CrowdAnalysisResponse(
+        seats=seats,
+        people=people,
+        free_entrance=free_entr,
+        included_cams=included_cams,
+        failed_cams=failed_cams,
+    )
+
+
+async def index_bus(bus_num: str | None, frontal: list[dict], processed: list[ProcResponse | None], result: CrowdAnalysisResponse,
+              updated: float | None = None):
+    """Puts the bus into `bus_index` if any of its frames carried coordinates"""
+    located = [x for x in processed if x is not None and x.lat is not None and x.lon is not None]
+    if not located:
+        return
+    latest = max(located, key=lambda x: x.timestamp or 0)
+    bus_num = bus_num or latest.bus_num
+    if bus_num is None:
+        return
+
+    loads = Counter(x.proc_data.load for x in processed[:len(frontal)] if x is not None)
+    load = loads.most_common(1)[0][0] if loads else None
+    try:
+        await bus_index.update(str(bus_num), latest.lat, latest.lon, result.seats, load, updated)
+    except Exception as e:
+        # the index only serves /buses/nearby: the analysis itself must not fail on it
+        print(f'bus {bus_num}: position not indexed: {e}')
+
+
+async def analyse_images(bus_num: str | None, frontal: list[dict], gate: list[dict], deadline: float) -> CrowdAnalysisResponse:
+    processed = await get_processed_images(frontal + gate, deadline)
+
+    result = summarize(frontal, gate, processed)
+    await index_bus(bus_num, frontal, processed, result)
+    if bus_num is not None:
+        await last_known.put(bus_num, result)
+    return result
+
+
+def revalidate(bus_num: str, frontal: list[dict], gate: list[dict]):
+    """Refreshes the last-known result of the bus in the background, one refresh per bus at a time over all workers"""
+    deadline = DEFAULT_DEADLINE_MS / 1000
+
+    async def refresh():
+        if not await last_known.claim_refresh(bus_num, ttl=deadline):
+            return
+        try:
+            if await breaker.admit():
+                await analyse_images(bus_num, frontal, gate, deadline)
+        except HTTPException as e:
+            print(f'bus {bus_num}: refresh failed: {e.detail}')
+        finally:
+            await last_known.release_refresh(bus_num)
+
+    task = asyncio.ensure_future(refresh())
+    refreshing.add(task)
+    task.add_done_callback(refreshing.discard)
 
-    return results
 
 @crowd_analysys_service.post('/api/v1/crowd_analysis')
-async def crowd_analysys(req: ProcRequest):
+async def crowd_analysys(req: ProcRequest) -> CrowdAnalysisResponse:
     frontal, gate = frontal_gated_images(req)
 
     if not len(frontal):
         raise HTTPException(400, 'There are no frontal images')
 
-    frontal_processed = await get_processed_images(frontal)
-    gate_processed = await get_processed_images(gate) if len(gate) else []
-    print(frontal_processed)
+    bus_num = req.bus_num or next((str(x['bus_num']) for x in frontal + gate if x.get('bus_num')), None)
+    cached = await last_known.get(bus_num) if bus_num is not None else None
+    if cached is not None:
+        result, age = cached
+        if age <= FRESH_S:
+            return result.model_copy(update={'age_s': age})
+        if age <= REVALIDATE_S:
+            revalidate(bus_num, frontal, gate)
+            return result.model_copy(update={'stale': True, 'age_s': age})
 
-    seats = np.mean([json.loads(x)['proc_data']['free_seats'] for x in frontal_processed]).astype(float)
+    # one decision for the whole request: a half-open trial gets all of its frames through
+    if not await breaker.admit():
+        if cached is None or cached[1] > MAX_STALE_S:
+            raise HTTPException(503, LLM_UNAVAILABLE)
+        result, age = cached
+        return result.model_copy(update={'stale': True, 'age_s': age})
 
-    people = np.mean([json.loads(x)['proc_data']['people_num'] for x in frontal_processed]).astype(float) + 1.5 * np.mean([json.loads(x)['proc_data']['people_num'] for x in gate_processed]).astype(float) if gate_processed else np.mean([json.loads(x)['proc_data']['people_num'] for x in frontal_processed]).astype(float)
-    
-    if len(gate):
-        frontal_free = [json.loads(x)['proc_data']['free_entrance'] for x in frontal_processed]
-        gate_free = [json.loads(x)['proc_data']['free_entrance'] for x in frontal_processed]
+    deadline = (req.deadline_ms or DEFAULT_DEADLINE_MS) / 1000
+    try:
+        return await analyse_images(bus_num, frontal, gate, deadline)
+    except HTTPException:
+        if cached is None or cached[1] > MAX_STALE_S:
+            raise
+        result, age = cached
+        return result.model_copy(update={'stale': True, 'age_s': age})
+
+
+async def analyse_bus(bus: FleetBus, deadline: float, priority: Priority) -> FleetBusResult:
+    frontal, gate = frontal_gated_images(bus)
+    if not frontal:
+        return FleetBusResult(bus_num=bus.bus_num, error='There are no frontal images')
+    if not await breaker.admit():
+        return FleetBusResult(bus_num=bus.bus_num, error=LLM_UNAVAILABLE)
+
+    images = [{**image, 'bus_num': image.get('bus_num') or bus.bus_num, 'priority': priority} for image in frontal + gate]
+    futures = [pool.submit(bus.bus_num, lambda image=image: process_image(image, deadline)) for image in images]
+    done, pending = await asyncio.wait(futures, timeout=deadline)
+    for future in pending:
+        future.cancel()
+    processed = [f.result() if f in done else None for f in futures]
+
+    try:
+        result = summarize(frontal, gate, processed)
+    except HTTPException as e:
+        return FleetBusResult(bus_num=bus.bus_num, error=e.detail)
+
+    await index_bus(bus.bus_num, frontal, processed, result, bus.taken_at)
+    await last_known.put(bus.bus_num, result, bus.taken_at)
+    return FleetBusResult(bus_num=bus.bus_num, result=result)
+
+
+@crowd_analysys_service.post('/api/v1/fleet_analysis')
+async def fleet_analysis(req: FleetRequest):
+    """Streams one NDJSON line per bus as soon as that bus is done"""
+    deadline = (req.deadline_ms or DEFAULT_DEADLINE_MS) / 1000
+    tasks = [asyncio.ensure_future(analyse_bus(bus, deadline, req.priority)) for bus in req.buses]
+
+    async def stream():
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield (await task).model_dump_json() + '\n'
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+
+@crowd_analysys_service.post('/api/v1/edge/ingest')
+async def edge_ingest(
+    request: Request,
+    content_encoding: Optional[str] = Header(None),
+    x_batch_id: Optional[str] = Header(None),
+) -> EdgeIngestResponse:
+    """
+    Bulk upload from an edge agent: gzip'd NDJSON of frames and delta encoded RSSI
+    summaries. Snapshots go through the same fair pool as /fleet_analysis. A batch
+    that was already accepted (same X-Batch-Id) is acknowledged without re-analysis;
+    one that is still being analysed by another request gets 409, to be retried.
+    If llm-service failed any snapshot the batch is not accepted: 503, the agent keeps it
+    """
+    if x_batch_id:
+        state = await batches.claim(x_batch_id)
+        if state == DONE:
+            return EdgeIngestResponse(batch_id=x_batch_id, duplicate=True)
+        if state is not None:
+            raise HTTPException(409, 'Batch is being processed, retry later')
+
+    try:
+        try:
+            body = bytearray()
+            async for chunk in request.stream():
+                body += chunk
+                if len(body) > EDGE_MAX_BATCH_BYTES:
+                    raise BatchTooLarge(f'Batch is larger than {EDGE_MAX_BATCH_BYTES} bytes')
+            records = read_batch(bytes(body), content_encoding, EDGE_MAX_BATCH_BYTES)
+            buses = snapshots(records)
+            rssi = [(r['bus_num'], delta_decode(r)) for r in records if r.get('type') == 'rssi']
+        except BatchTooLarge as e:
+            raise HTTPException(413, str(e))
+        except (zlib.error, ValueError, KeyError, TypeError, ValidationError) as e:
+            raise HTTPException(400, f'Malformed batch: {e}')
+
+        # backfill from a reconnecting agent must not compete with riders in llm-service
+        deadline = DEFAULT_DEADLINE_MS / 1000
+        results = await asyncio.gather(*(analyse_bus(bus, deadline, 'low') for bus in buses))
+        if any(result.error in UPSTREAM_ERRORS for result in results):
+            raise HTTPException(503, LLM_UNAVAILABLE)
+
+        for bus_num, rows in rssi:
+            await rssi_history.add(bus_num, rows)
+    except BaseException:
+        if x_batch_id:
+            await batches.release(x_batch_id)
+        raise
+
+    if x_batch_id:
+        await batches.done(x_batch_id)
+
+    return EdgeIngestResponse(
+        batch_id=x_batch_id,
+        frames=sum(len(bus.images) for bus in buses),
+        rssi_rows=sum(len(rows) for _, rows in rssi),
+        results=results,
+    )
 
-        summurized_stat = list(filter(lambda x: x != 0, frontal_free + gate_free))
-    else:
-        frontal_free = [json.loads(x)['proc_data']['free_entrance'] for x in frontal_processed]
 
-        summurized_stat = list(filter(lambda x: x != 0, frontal_free))
+@crowd_analysys_service.get('/api/v1/edge/rssi/{bus_num}')
+async def edge_rssi(bus_num: str, limit: int = Query(60, ge=1, le=1440)) -> list[dict]:
+    """Latest RSSI summary rows uploaded by the bus's edge agent"""
+    return await rssi_history.get(bus_num, limit)
 
-    if summurized_stat:
-        unsqueezed_summurized_stat = []
-        for elem in summurized_stat:
-            unsqueezed_summurized_stat += elem
-        print(unsqueezed_summurized_stat)
-        free_entr = Counter(unsqueezed_summurized_stat).most_common(1)[0][0]
-    else:
-        free_entr = 0
-    seats = int(ceil(seats))
-    people = int(ceil(people))
 
-    return {
-        'seats': seats,
-        'people': people,
-        'free_entrance': free_entr
-    }
+@crowd_analysys_service.get('/api/v1/buses/nearby')
+async def buses_nearby(
+    lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    k: Optional[int] = Query(None, ge=1, le=100),
+    radius_m: Optional[float] = Query(None, gt=0),
+    min_free_seats: Optional[int] = None,
+    max_load: Optional[str] = None,
+    max_age_s: Optional[float] = None,
+) -> list[NearbyBus]:
+    """k nearest buses (5 by default), or all within radius_m if only the radius is given; never calls the LLM"""
+    if max_load is not None and max_load not in LOAD_LEVELS:
+        raise HTTPException(400, f'max_load must be one of {list(LOAD_LEVELS)}')
+    filters = dict(min_free_seats=min_free_seats, max_load=max_load, max_age_s=max_age_s)
+    if k is None and radius_m is not None:
+        return await bus_index.within(lat, lon, radius_m, **filters)
+    return await bus_index.nearest(lat, lon, k=k or 5, radius_m=radius_m, **filters)
 
 
 if __name__ == '__main__':
     uvicorn.run(
-        app=crowd_analysys_service,
+        app='service:crowd_analysys_service',
         host='0.0.0.0',
-        port=1338
+        port=1338,
+        workers=int(os.getenv('WORKERS', 1))
     )
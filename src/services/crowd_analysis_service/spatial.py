@@ -0,0 +1,222 @@
+import time
+from math import asin, cos, radians, sin, sqrt
+
+from backend import RedisBackend
+
+
+EARTH_RADIUS_M = 6371000
+LOAD_LEVELS = {'free': 0, 'average': 1, 'full': 2}
+
+BUS_GEO_KEY = 'crowd:buses'
+BUS_PREFIX = 'crowd:bus:'
+# half the equator: a radius that covers the whole globe
+MAX_RADIUS_M = 20037000
+
+# KEYS: geo set, bus hash; ARGV: lat, lon, updated, free_seats, load, bus_num, retention ms
+UPDATE_BUS_LUA = '''
+local old = tonumber(redis.call('HGET', KEYS[2], 'updated'))
+if old and old > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('GEOADD', KEYS[1], ARGV[2], ARGV[1], ARGV[6])
+redis.call('HSET', KEYS[2], 'lat', ARGV[1], 'lon', ARGV[2], 'updated', ARGV[3], 'free_seats', ARGV[4], 'load', ARGV[5])
+redis.call('PEXPIRE', KEYS[2], ARGV[7])
+return 1
+'''
+
+
+def haversine_m(lat1, lon1, lat2, lon2) -> float:
+    dlat, dlon = radians(lat2 - lat1), radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * asin(sqrt(a))
+
+
+class BusPosition:
+    __slots__ = ('bus_num', 'lat', 'lon', 'free_seats', 'load', 'updated', 'cell')
+
+    def __init__(self, bus_num, lat, lon, free_seats, load, updated, cell):
+        self.bus_num = bus_num
+        self.lat = lat
+        self.lon = lon
+        self.free_seats = free_seats
+        self.load = load
+        self.updated = updated
+        self.cell = cell
+
+    def as_dict(self, distance_m: float) -> dict:
+        return {
+            'bus_num': self.bus_num,
+            'lat': self.lat,
+            'lon': self.lon,
+            'free_seats': self.free_seats,
+            'load': self.load,
+            'age_s': time.time() - self.updated,
+            'distance_m': distance_m,
+        }
+
+
+def matches(bus: BusPosition, now, min_free_seats, max_load, max_age_s) -> bool:
+    if now - bus.updated > max_age_s:
+        return False
+    if min_free_seats is not None and bus.free_seats < min_free_seats:
+        return False
+    if max_load is not None and LOAD_LEVELS.get(bus.load, 0) > LOAD_LEVELS[max_load]:
+        return False
+    return True
+
+
+class BusIndex:
+    '''
+    Latest position and occupancy per bus_num in a uniform lat/lon grid.
+    An update moves the bus between two cells; queries scan rings of cells
+    around the point, so they only touch buses nearby. In process memory:
+    only for STATE_BACKEND_URL=memory:// with a single worker.
+    '''
+    def __init__(self, cell_deg: float = 0.005, max_age_s: float = 600):
+        self.cell_deg = cell_deg
+        self.max_age_s = max_age_s
+        self.buses: dict[str, BusPosition] = {}
+        self.cells: dict[tuple[int, int], set[str]] = {}
+
+    def _cell(self, lat, lon) -> tuple[int, int]:
+        return int(lat // self.cell_deg), int(lon // self.cell_deg)
+
+    async def update(self, bus_num: str, lat: float, lon: float, free_seats: int, load: str | None, updated=None):
+        updated = time.time() if updated is None else updated
+        old = self.buses.get(bus_num)
+        if old is not None and old.updated > updated:
+            return  # a late upload of older frames must not replace a newer position
+        cell = self._cell(lat, lon)
+        if old is not None and old.cell != cell:
+            self.cells[old.cell].discard(bus_num)
+            if not self.cells[old.cell]:
+                del self.cells[old.cell]
+        self.cells.setdefault(cell, set()).add(bus_num)
+        self.buses[bus_num] = BusPosition(bus_num, lat, lon, free_seats, load, updated, cell)
+
+    def _ring(self, center: tuple[int, int], r: int):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield ci - r, j
+            yield ci + r, j
+        for i in range(ci - r + 1, ci + r):
+            yield i, cj - r
+            yield i, cj + r
+
+    def _cell_min_m(self, lat) -> float:
+        '''Shortest side of a grid cell in meters around `lat`'''
+        lat_m = radians(self.cell_deg) * EARTH_RADIUS_M
+        return lat_m * max(cos(radians(min(abs(lat) + self.cell_deg, 89.9))), 1e-6)
+
+    def _search(self, lat, lon, radius_m, k, min_free_seats, max_load, max_age_s) -> list[dict]:
+        now = time.time()
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        center = self._cell(lat, lon)
+        cell_m = self._cell_min_m(lat)
+        found = []
+        seen = 0
+        r = 0
+        while seen < len(self.buses):
+            if (2 * r + 1) ** 2 > 4 * len(self.cells):
+                # the rings have grown past the occupied area: cheaper to check every bus
+                found = [
+                    (haversine_m(lat, lon, bus.lat, bus.lon), bus)
+                    for bus in self.buses.values()
+                    if matches(bus, now, min_free_seats, max_load, max_age_s)
+                ]
+                found = sorted((x for x in found if radius_m is None or x[0] <= radius_m), key=lambda x: x[0])
+                break
+            # everything outside ring r - 1 is at least (r - 1) cells away
+            bound = (r - 1) * cell_m if r else 0.0
+            if radius_m is not None and bound > radius_m:
+                break
+            if k is not None and len(found) >= k and found[k - 1][0] <= bound:
+                break
+            for cell in self._ring(center, r):
+                for bus_num in self.cells.get(cell, ()):
+                    seen += 1
+                    bus = self.buses[bus_num]
+                    if not matches(bus, now, min_free_seats, max_load, max_age_s):
+                        continue
+                    distance = haversine_m(lat, lon, bus.lat, bus.lon)
+                    if radius_m is None or distance <= radius_m:
+                        found.append((distance, bus))
+            found.sort(key=lambda x: x[0])
+            r += 1
+        if k is not None:
+            found = found[:k]
+        return [bus.as_dict(distance) for distance, bus in found]
+
+    async def nearest(self, lat, lon, k=5, radius_m=None, min_free_seats=None, max_load=None, max_age_s=None) -> list[dict]:
+        return self._search(lat, lon, radius_m, k, min_free_seats, max_load, max_age_s)
+
+    async def within(self, lat, lon, radius_m, min_free_seats=None, max_load=None, max_age_s=None) -> list[dict]:
+        return self._search(lat, lon, radius_m, None, min_free_seats, max_load, max_age_s)
+
+
+class RedisBusIndex:
+    '''
+    The same queries over Redis GEO, shared by all workers: positions in one
+    geo set, occupancy in a hash per bus that expires after `retention_s`.
+    Members whose hash has expired are dropped from the geo set when a query meets them.
+    '''
+    def __init__(self, redis, max_age_s: float = 600, retention_s: float = 24 * 3600):
+        self.redis = redis
+        self.max_age_s = max_age_s
+        self.retention_s = retention_s
+        self.update_bus = redis.register_script(UPDATE_BUS_LUA)
+
+    async def update(self, bus_num: str, lat: float, lon: float, free_seats: int, load: str | None, updated=None):
+        updated = time.time() if updated is None else updated
+        await self.update_bus(
+            keys=[BUS_GEO_KEY, BUS_PREFIX + bus_num],
+            args=[lat, lon, updated, free_seats, load or '', bus_num, int(self.retention_s * 1000)],
+        )
+
+    async def _search(self, lat, lon, radius_m, k, min_free_seats, max_load, max_age_s) -> list[dict]:
+        now = time.time()
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        # filters run after the geo search, so ask for more than k and widen if they drop too many
+        count = None if k is None else k * 4
+        while True:
+            hits = await self.redis.geosearch(
+                BUS_GEO_KEY, longitude=lon, latitude=lat, radius=radius_m or MAX_RADIUS_M, unit='m',
+                sort='ASC', count=count, withdist=True,
+            )
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for name, _ in hits:
+                    pipe.hgetall(BUS_PREFIX + name.decode())
+                rows = await pipe.execute()
+
+            found, gone = [], []
+            for (name, distance), row in zip(hits, rows):
+                if not row:
+                    gone.append(name)
+                    continue
+                bus = BusPosition(
+                    name.decode(), float(row[b'lat']), float(row[b'lon']), int(row[b'free_seats']),
+                    row[b'load'].decode() or None, float(row[b'updated']), None,
+                )
+                if matches(bus, now, min_free_seats, max_load, max_age_s):
+                    found.append(bus.as_dict(float(distance)))
+            if gone:
+                await self.redis.zrem(BUS_GEO_KEY, *gone)
+
+            if count is None or len(found) >= k or len(hits) < count:
+                return found if k is None else found[:k]
+            count *= 4
+
+    async def nearest(self, lat, lon, k=5, radius_m=None, min_free_seats=None, max_load=None, max_age_s=None) -> list[dict]:
+        return await self._search(lat, lon, radius_m, k, min_free_seats, max_load, max_age_s)
+
+    async def within(self, lat, lon, radius_m, min_free_seats=None, max_load=None, max_age_s=None) -> list[dict]:
+        return await self._search(lat, lon, radius_m, None, min_free_seats, max_load, max_age_s)
+
+
+def make_bus_index(backend, cell_deg: float = 0.005, max_age_s: float = 600):
+    if isinstance(backend, RedisBackend):
+        return RedisBusIndex(backend.redis, max_age_s=max_age_s)
+    return BusIndex(cell_deg=cell_deg, max_age_s=max_age_s)
@@ -0,0 +1,83 @@
+import base64
+import io
+import json
+
+from PIL import Image, ImageDraw
+
+from models import CameraConfig
+
+
+CAMERA_PREFIX = 'llm:camera:'
+JPEG_QUALITY = 85
+
+
+class CameraRegistry:
+    '''CameraConfig per bus_num + cam_num, stored in the shared state backend'''
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(bus_num, cam_num) -> str:
+        return f'{CAMERA_PREFIX}{bus_num}:{cam_num}'
+
+    async def get(self, bus_num, cam_num) -> CameraConfig | None:
+        if bus_num is None or cam_num is None:
+            return None
+        raw = await self.backend.get(self._key(bus_num, cam_num))
+        return CameraConfig.model_validate_json(raw) if raw else None
+
+    async def put(self, bus_num, cam_num, config: CameraConfig):
+        await self.backend.set(self._key(bus_num, cam_num), config.model_dump_json().encode())
+
+    async def delete(self, bus_num, cam_num):
+        await self.backend.delete(self._key(bus_num, cam_num))
+
+    async def all(self) -> dict[str, CameraConfig]:
+        cameras = {}
+        for key in await self.backend.keys(CAMERA_PREFIX):
+            raw = await self.backend.get(key)
+            if raw:
+                cameras[key[len(CAMERA_PREFIX):]] = CameraConfig.model_validate_json(raw)
+        return cameras
+
+    async def load_file(self, path: str):
+        '''Seeds the registry from {"<bus_num>:<cam_num>": CameraConfig, ...}; existing entries win'''
+        with open(path) as f:
+            seed = json.load(f)
+        for name, config in seed.items():
+            bus_num, cam_num = name.rsplit(':', 1)
+            if await self.get(bus_num, cam_num) is None:
+                await self.put(bus_num, cam_num, CameraConfig.model_validate(config))
+
+
+def crop_to_roi(image_bytes: str, config: CameraConfig) -> str:
+    '''
+    Crops a base64 frame to the camera ROI and returns it as base64 JPEG.
+    ROI coordinates are fractions of the frame size, so they survive
+    resolution changes. CPU bound: run it in a thread pool.
+    '''
+    image = Image.open(io.BytesIO(base64.b64decode(image_bytes))).convert('RGB')
+    width, height = image.size
+
+    if config.roi:
+        points = [(x * width, y * height) for x, y in config.roi]
+    else:
+        x0, y0, x1, y1 = config.rect
+        points = [(x0 * width, y0 * height), (x1 * width, y0 * height),
+                  (x1 * width, y1 * height), (x0 * width, y1 * height)]
+
+    if config.mask and config.roi:
+        mask = Image.new('L', image.size, 0)
+        ImageDraw.Draw(mask).polygon(points, fill=255)
+        image = Image.composite(image, Image.new('RGB', image.size), mask)
+
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    box = (
+        max(0, int(min(xs))), max(0, int(min(ys))),
+        min(width, int(round(max(xs)))), min(height, int(round(max(ys)))),
+    )
+    image = image.crop(box)
+
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=JPEG_QUALITY)
+    return base64.b64encode(out.getvalue()).decode()
@@ -1,5 +1,7 @@
-from pydantic import BaseModel, Field
-from typing import Optional, Union, List
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, Union, List, Literal
+
+Priority = Literal['high', 'low']
 
 class ProcRequest(BaseModel):
     lat: Optional[float] = None
@@ -10,9 +12,56 @@ class ProcRequest(BaseModel):
     cam_num: Optional[int] = None
     cam_info: Optional[str] = None
     gate_pos: Optional[list[int] | int] = None # list if frontal
+    priority: Optional[Priority] = None # high for riders, low for batch jobs; X-Priority header works too
 
 class BusAnalysisResponse(BaseModel):
     load: str = Field(description="Estimated bus occupancy. One of three possible states: free, average, or full")
     people_num: int = Field(description="Actual number of people")
     free_entrance: List[int] = Field(description="Freest entrance(s). If gate_num is a single number, return that number or 0 if all exits are full. If gate_num is an array, return an array of freest entrances in order of preference or [0] if all exits are full.")
-    free_seats: int = Field(description="Actual number of free seats in bus")
\ No newline at end of file
+    free_seats: int = Field(description="Actual number of free seats in bus")
+
+class ProcResponse(BaseModel):
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    timestamp: Optional[int] = None
+    bus_num: Optional[str] = None
+    cam_num: Optional[int] = None
+    cam_info: Optional[str] = None
+    gate_pos: Optional[list[int] | int] = None
+    proc_data: BusAnalysisResponse
+
+
+# smallest ROI, as a fraction of the frame area, that still leaves the model something to look at
+MIN_ROI_AREA = 0.01
+
+
+class CameraConfig(BaseModel):
+    roi: Optional[list[tuple[float, float]]] = Field(None, description="ROI polygon, points as fractions of frame width/height")
+    rect: Optional[tuple[float, float, float, float]] = Field(None, description="ROI rectangle x0, y0, x1, y1 as fractions")
+    mask: bool = Field(False, description="Black out everything outside the polygon, not only crop to its bounding box")
+    cam_info: Optional[str] = None
+    gate_pos: Optional[list[int] | int] = None
+
+    @model_validator(mode='after')
+    def check_roi(self):
+        if self.roi is not None and len(self.roi) < 3:
+            raise ValueError('roi needs at least 3 points')
+        for x, y in (self.roi or []) + ([self.rect[:2], self.rect[2:]] if self.rect else []):
+            if not (0 <= x <= 1 and 0 <= y <= 1):
+                raise ValueError('ROI coordinates are fractions in [0, 1]')
+        if self.rect is not None:
+            x0, y0, x1, y1 = self.rect
+            if not (x0 < x1 and y0 < y1):
+                raise ValueError('rect must be x0, y0, x1, y1 with x0 < x1 and y0 < y1')
+        # the area of what crop_to_roi will use: the polygon if there is one
+        if self.roi is not None:
+            # shoelace formula; self-intersecting polygons that cancel out are rejected as well
+            area = abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(self.roi, self.roi[1:] + self.roi[:1]))) / 2
+        elif self.rect is not None:
+            x0, y0, x1, y1 = self.rect
+            area = (x1 - x0) * (y1 - y0)
+        else:
+            return self
+        if area < MIN_ROI_AREA:
+            raise ValueError(f'ROI covers less than {MIN_ROI_AREA:.0%} of the frame')
+        return self
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+HIGH = 'high'
+LOW = 'low'
+
+
+class PriorityLimiter:
+    '''
+    Caps concurrent upstream LLM calls at `capacity`. High priority (rider-facing)
+    calls are served first and `reserved` slots are never given to low priority
+    (batch) calls. While high calls are waiting, a low call that has waited
+    `max_low_wait` seconds gets one slot per `low_every` high admissions, so
+    batches slow down under load but never stall.
+    '''
+    def __init__(self, capacity: int, reserved: int, max_low_wait: float, low_every: int = 4):
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.max_low_wait = max_low_wait
+        self.low_every = max(1, low_every)
+        self.running = {HIGH: 0, LOW: 0}
+        self.waiting = {HIGH: deque(), LOW: deque()}  # (enqueued_at, future)
+        self.high_since_low = 0
+
+    def _admit(self, now: float) -> str | None:
+        if sum(self.running.values()) >= self.capacity:
+            return None
+        high, low = self.waiting[HIGH], self.waiting[LOW]
+        if low and self.running[LOW] < self.capacity - self.reserved:
+            if not high:
+                return LOW
+            if now - low[0][0] >= self.max_low_wait and self.high_since_low >= self.low_every:
+                return LOW
+        if high:
+            return HIGH
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for queue in self.waiting.values():
+            while queue and queue[0][1].done():  # cancelled while waiting
+                queue.popleft()
+        while (priority := self._admit(now)) is not None:
+            _, future = self.waiting[priority].popleft()
+            if future.done():
+                continue
+            self.running[priority] += 1
+            self.high_since_low = self.high_since_low + 1 if priority == HIGH else 0
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: str):
+        queue = self.waiting[priority]
+        future = asyncio.get_running_loop().create_future()
+        queue.append((time.monotonic(), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.running[priority] -= 1
+                self._dispatch()
+            raise
+        try:
+            yield
+        finally:
+            self.running[priority] -= 1
+            self._dispatch()
+
+    def snapshot(self) -> dict:
+        return {
+            'capacity': self.capacity,
+            'reserved_high': self.reserved,
+            'running': dict(self.running),
+            'waiting': {priority: len(queue) for priority, queue in self.waiting.items()},
+        }
@@ -1,23 +1,32 @@
-from openai import AsyncOpenAI
-import json
-from fastapi import FastAPI, HTTPException
+import time
+STARTED = time.monotonic()
+
+from contextlib import asynccontextmanager
+
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
 
 from models import *
 from prompts import *
+from usage import UsageStats, estimate_image_tokens
+from backend import make_backend
+from priority import PriorityLimiter, HIGH
+from cameras import CameraRegistry, crop_to_roi
+from sink import ResultSink
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import os
 
 import uvicorn
 
 
-llm_service = FastAPI(
-    prefix='/api/v1'
-)
-
 MAX_RETRIES = 3
-
-from pydantic import BaseModel, Field
-from typing import Union, List
+# how long a successful upstream probe is trusted by /ready
+READY_TTL = float(os.getenv('READY_TTL', 15))
 
 client = AsyncOpenAI(
     api_key=os.getenv('OPENAI_API_KEY'),
@@ -25,58 +34,220 @@ client = AsyncOpenAI(
 )
 
 
+# Everything that is identical between calls goes first and is built once, so the
+# provider can reuse the cached prompt prefix; only the user turn changes per frame
+SYSTEM_MESSAGE = {"role": "system", "content": main_prompt['system']}
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "bus_analysis",
+        "schema": BusAnalysisResponse.model_json_schema()
+    }
+}
+
+backend = make_backend()
+usage_stats = UsageStats(backend)
+cameras = CameraRegistry(backend)
+# decoding/cropping/encoding frames is CPU work, keep it off the event loop
+crop_executor = ThreadPoolExecutor(int(os.getenv('CROP_WORKERS', 4)))
+
+# every analysed frame (without the image) goes to SINK_DIR; SINK_FORMAT=none turns it off
+sink = None
+if os.getenv('SINK_FORMAT', 'jsonl.zst') != 'none':
+    sink = ResultSink(
+        directory=os.getenv('SINK_DIR', 'results'),
+        fmt=os.getenv('SINK_FORMAT', 'jsonl.zst'),
+        max_bytes=int(os.getenv('SINK_MAX_MB', 64)) * 2**20,
+        max_age=float(os.getenv('SINK_MAX_AGE', 3600)),
+    )
+
+# per worker: at most LLM_CONCURRENCY calls in flight, LLM_RESERVED_HIGH of them only for high priority;
+# the cap bounds throughput at LLM_CONCURRENCY / upstream latency per worker
+limiter = PriorityLimiter(
+    capacity=int(os.getenv('LLM_CONCURRENCY', 16)),
+    reserved=int(os.getenv('LLM_RESERVED_HIGH', 4)),
+    max_low_wait=float(os.getenv('LLM_LOW_MAX_WAIT', 30)),
+    low_every=int(os.getenv('LLM_LOW_EVERY', 4)),
+)
+
+status = {
+    'warm': False,
+    'startup_s': None,
+    'upstream_ok': False,
+    'upstream_checked': 0.0,
+}
+
+
+async def probe_upstream() -> bool:
+    '''Any HTTP answer from the provider means it is reachable and the connection pool is open'''
+    try:
+        await client.with_options(max_retries=0).models.list(timeout=5)
+        ok = True
+    except APIStatusError:
+        ok = True
+    except APIConnectionError as e:
+        print(f'LLM provider is not reachable: {e}')
+        ok = False
+    status['upstream_ok'] = ok
+    status['upstream_checked'] = time.monotonic()
+    return ok
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv('CAMERA_REGISTRY_FILE'):
+        await cameras.load_file(os.getenv('CAMERA_REGISTRY_FILE'))
+    if sink is not None:
+        sink.start()
+    await probe_upstream()
+    status['warm'] = True
+    status['startup_s'] = time.monotonic() - STARTED
+    print(f"llm-service started in {status['startup_s']:.2f}s")
+    yield
+    if sink is not None:
+        await sink.close()
+    await client.close()
+    await backend.close()
+    crop_executor.shutdown()
+
+
+llm_service = FastAPI(
+    prefix='/api/v1',
+    lifespan=lifespan,
+)
+
+
+@llm_service.get('/health')
+async def health():
+    return {'status': 'ok', 'startup_s': status['startup_s']}
+
+
+@llm_service.get('/ready')
+async def ready():
+    if status['warm'] and time.monotonic() - status['upstream_checked'] > READY_TTL:
+        await probe_upstream()
+    ready = status['warm'] and status['upstream_ok']
+    return JSONResponse(
+        {'ready': ready, 'upstream_ok': status['upstream_ok'], 'startup_s': status['startup_s']},
+        status_code=200 if ready else 503,
+    )
+
+
 @llm_service.post('/api/v1/proc_image')
-async def proc_image(req: ProcRequest):
-    for _ in range(MAX_RETRIES):
-        try:
-            llm_output = await client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": main_prompt['system']},
-                        ]
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": main_prompt['user'].format(gatenum=req.gate_pos)
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{req.image_bytes}"
-                                }
-                            },
-                        ],
-                    }],
-                    response_format={
-                        "type": "json_schema",
-                        "json_schema": {
-                            "name": "bus_analysis",
-                            "schema": BusAnalysisResponse.model_json_schema()
-                        }                    
-                    }
-            )
-            result = llm_output.choices[0].message.content
+async def proc_image(req: ProcRequest, x_priority: Optional[Priority] = Header(None)) -> ProcResponse:
+    priority = req.priority or x_priority or HIGH
 
+    try:
+        camera = await cameras.get(req.bus_num, req.cam_num)
+    except Exception as e:
+        # the registry only trims the frame, so analyse it without one rather than fail
+        print(f'camera registry unavailable: {e}')
+        camera = None
+    if camera is not None:
+        req = req.model_copy(update={
+            'gate_pos': req.gate_pos if req.gate_pos is not None else camera.gate_pos,
+            'cam_info': req.cam_info or camera.cam_info,
+        })
+        if camera.roi or camera.rect:
+            try:
+                image_bytes = await asyncio.get_running_loop().run_in_executor(
+                    crop_executor, crop_to_roi, req.image_bytes, camera
+                )
+                req = req.model_copy(update={'image_bytes': image_bytes})
+            except Exception as e:
+                print(f'ROI crop failed, sending the full frame: {e}')
 
-            print(result)
-            response = req.model_dump()
-            del response['image_bytes']
-            response['proc_data'] = json.loads(result)
-            return json.dumps(response)
+    image_tokens = estimate_image_tokens(req.image_bytes)
+    for _ in range(MAX_RETRIES):
+        try:
+            async with limiter.slot(priority):
+                start = time.monotonic()
+                llm_output = await client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                        SYSTEM_MESSAGE,
+                        {
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": main_prompt['user'].format(gatenum=req.gate_pos)
+                                },
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:image/jpeg;base64,{req.image_bytes}"
+                                    }
+                                },
+                            ],
+                        }],
+                        response_format=RESPONSE_FORMAT
+                )
         except Exception as e:
+            await usage_stats.record_failure()
+            print(e)
+            continue
+
+        # best effort and outside the try: the completion is paid for, metrics must not cause another call
+        usage = await usage_stats.record(llm_output.usage, image_tokens, time.monotonic() - start)
+        try:
+            result = llm_output.choices[0].message.content
+            print(result, usage)
+            proc_data = BusAnalysisResponse.model_validate_json(result)
+        except (IndexError, ValidationError) as e:
+            await usage_stats.record_failure()
             print(e)
+            continue
+
+        response = ProcResponse(
+            **req.model_dump(exclude={'image_bytes', 'priority'}),
+            proc_data=proc_data,
+        )
+        if sink is not None:
+            sink.put({'analysed_at': time.time(), **response.model_dump()})
+        return response
     raise HTTPException(500, 'something not good : (')
 
 
+@llm_service.get('/api/v1/usage')
+async def usage():
+    return await usage_stats.snapshot()
+
+
+@llm_service.get('/api/v1/cameras')
+async def list_cameras() -> dict[str, CameraConfig]:
+    return await cameras.all()
+
+
+@llm_service.get('/api/v1/cameras/{bus_num}/{cam_num}')
+async def get_camera(bus_num: str, cam_num: int) -> CameraConfig:
+    camera = await cameras.get(bus_num, cam_num)
+    if camera is None:
+        raise HTTPException(404, 'Camera is not registered')
+    return camera
+
+
+@llm_service.put('/api/v1/cameras/{bus_num}/{cam_num}')
+async def put_camera(bus_num: str, cam_num: int, config: CameraConfig) -> CameraConfig:
+    await cameras.put(bus_num, cam_num, config)
+    return config
+
+
+@llm_service.delete('/api/v1/cameras/{bus_num}/{cam_num}')
+async def delete_camera(bus_num: str, cam_num: int):
+    await cameras.delete(bus_num, cam_num)
+    return {'deleted': f'{bus_num}:{cam_num}'}
+
+
+@llm_service.get('/api/v1/queue')
+async def queue():
+    return {**limiter.snapshot(), 'sink': sink.snapshot() if sink is not None else None}
+
+
 if __name__ == '__main__':
     uvicorn.run(
-        app=llm_service,
+        app='service:llm_service',
         host='0.0.0.0',
-        port=1337
+        port=1337,
+        workers=int(os.getenv('WORKERS', 1))
     )
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import time
+
+
+# Append-only log of analysed frames. proc_image only enqueues a record; a
+# background task batches them and writes in a thread, so disk speed never
+# shows up in request latency. If the queue is full, records are dropped and
+# counted rather than making the request wait.
+
+PARQUET_FIELDS = ('analysed_at', 'lat', 'lon', 'timestamp', 'bus_num', 'cam_num', 'cam_info',
+                  'gate_pos', 'load', 'people_num', 'free_entrance', 'free_seats')
+
+
+class JsonlWriter:
+    '''One JSON object per line; with zstd every batch is its own frame, so a crash loses at most a batch'''
+    def __init__(self, path: str, compress: bool):
+        self.file = open(path, 'ab')
+        self.compressor = None
+        if compress:
+            import zstandard
+
+            self.compressor = zstandard.ZstdCompressor(level=3)
+
+    def write(self, batch: list[dict]) -> int:
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in batch).encode()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+        self.file.flush()
+        return len(data)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    '''Flat columns, one row group per batch; the file is readable once closed (on roll/shutdown)'''
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ('analysed_at', pa.float64()),
+            ('lat', pa.float64()),
+            ('lon', pa.float64()),
+            ('timestamp', pa.int64()),
+            ('bus_num', pa.string()),
+            ('cam_num', pa.int64()),
+            ('cam_info', pa.string()),
+            ('gate_pos', pa.list_(pa.int64())),
+            ('load', pa.string()),
+            ('people_num', pa.int64()),
+            ('free_entrance', pa.list_(pa.int64())),
+            ('free_seats', pa.int64()),
+        ])
+        self.path = path
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, batch: list[dict]) -> int:
+        rows = []
+        for record in batch:
+            row = {**record, **record.get('proc_data', {})}
+            if isinstance(row.get('gate_pos'), int):
+                row['gate_pos'] = [row['gate_pos']]
+            rows.append({field: row.get(field) for field in PARQUET_FIELDS})
+        before = os.path.getsize(self.path)
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+        return os.path.getsize(self.path) - before
+
+    def close(self):
+        self.writer.close()
+
+
+class ResultSink:
+    def __init__(self, directory: str, fmt: str = 'jsonl.zst', batch_size: int = 256,
+                 flush_interval: float = 1.0, max_bytes: int = 64 * 2**20, max_age: float = 3600,
+                 queue_size: int = 10000):
+        if fmt not in ('jsonl', 'jsonl.zst', 'parquet'):
+            raise ValueError(f'Unknown sink format: {fmt}')
+        # writers import their libraries lazily: check at startup, not on the first batch
+        if fmt == 'parquet':
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError as e:
+                raise RuntimeError('Sink format parquet needs pyarrow, which is not installed') from e
+        self.directory = directory
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.queue = asyncio.Queue(queue_size)
+        self.task = None
+        self.writer = None
+        self.file_bytes = 0
+        self.file_opened = 0.0
+        self.files = 0
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.task = asyncio.create_task(self._run())
+
+    def put(self, record: dict):
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def close(self):
+        '''Writes out everything queued and closes the current file'''
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                # idle: roll now rather than on the next write, a Parquet file is unreadable until closed
+                if self._due():
+                    await asyncio.to_thread(self._close_file)
+                continue
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f'Result sink write failed: {e}')
+        if self.writer is not None:
+            await asyncio.to_thread(self._close_file)
+
+    def _open(self):
+        self.files += 1
+        name = f"frames-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.files}.{self.fmt}"
+        path = os.path.join(self.directory, name)
+        if self.fmt == 'parquet':
+            self.writer = ParquetWriter(path)
+        else:
+            self.writer = JsonlWriter(path, compress=self.fmt == 'jsonl.zst')
+        self.file_bytes = 0
+        self.file_opened = time.monotonic()
+
+    def _due(self) -> bool:
+        '''Whether the current file is past SINK_MAX_MB or SINK_MAX_AGE'''
+        if self.writer is None:
+            return False
+        return self.file_bytes >= self.max_bytes or time.monotonic() - self.file_opened >= self.max_age
+
+    def _close_file(self):
+        self.writer.close()
+        self.writer = None
+
+    def _write(self, batch: list[dict]):
+        if self._due():
+            self._close_file()
+        if self.writer is None:
+            self._open()
+        self.file_bytes += self.writer.write(batch)
+        self.written += len(batch)
+
+    def snapshot(self) -> dict:
+        return {
+            'format': self.fmt,
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,93 @@
+import base64
+import struct
+from math import ceil
+
+
+# gpt-4o-mini vision pricing in tokens: a fixed base plus a cost per 512px tile
+IMAGE_BASE_TOKENS = 2833
+IMAGE_TILE_TOKENS = 5667
+
+
+def image_size(image_bytes: str) -> tuple[int, int] | None:
+    '''(width, height) from the header of a base64 PNG/JPEG, without decoding pixels'''
+    try:
+        head = base64.b64decode(image_bytes[:87384])  # first 64 KiB is enough for the JPEG SOF
+    except ValueError:
+        return None
+
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and len(head) >= 24:
+        return struct.unpack('>II', head[16:24])
+
+    if head[:2] == b'\xff\xd8':
+        i = 2
+        while i + 9 < len(head):
+            if head[i] != 0xFF:
+                i += 1
+                continue
+            marker = head[i + 1]
+            if marker in (0xC0, 0xC1, 0xC2):
+                height, width = struct.unpack('>HH', head[i + 5:i + 9])
+                return width, height
+            length = struct.unpack('>H', head[i + 2:i + 4])[0]
+            i += 2 + length
+    return None
+
+
+def estimate_image_tokens(image_bytes: str) -> int:
+    '''OpenAI's high-detail formula: fit into 2048x2048, shortest side to 768, count 512px tiles'''
+    size = image_size(image_bytes)
+    if size is None:
+        return IMAGE_BASE_TOKENS
+    width, height = size
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * ceil(width / 512) * ceil(height / 512)
+
+
+USAGE_KEY = 'llm:usage'
+COUNTERS = ('requests', 'failures', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'image_tokens', 'latency_s')
+
+
+class UsageStats:
+    '''Token/latency counters for upstream LLM calls, summed over all workers in `backend`'''
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def record(self, usage, image_tokens: int, latency_s: float) -> dict:
+        '''Adds the `usage` field of a chat completion; returns this call's numbers'''
+        details = getattr(usage, 'prompt_tokens_details', None)
+        call = {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'cached_tokens': getattr(details, 'cached_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+            # some providers report it, otherwise fall back to the estimate
+            'image_tokens': getattr(details, 'image_tokens', None) or image_tokens,
+            'latency_s': latency_s,
+        }
+        await self._add({'requests': 1, **call})
+        return call
+
+    async def record_failure(self):
+        await self._add({'failures': 1})
+
+    async def _add(self, amounts: dict):
+        # best effort: an unreachable backend must not fail a request whose LLM call already succeeded
+        try:
+            await self.backend.hincr(USAGE_KEY, amounts)
+        except Exception as e:
+            print(f'usage not recorded: {e}')
+
+    async def snapshot(self) -> dict:
+        stats = {name: 0 for name in COUNTERS}
+        stats.update(await self.backend.hgetall(USAGE_KEY))
+        n = stats['requests'] or 1
+        latency_s = stats.pop('latency_s')
+        return {
+            **{name: int(value) for name, value in stats.items()},
+            'cache_hit_ratio': stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0,
+            'avg_prompt_tokens': stats['prompt_tokens'] / n,
+            'avg_completion_tokens': stats['completion_tokens'] / n,
+            'avg_latency_s': latency_s / n,
+        }
@@ -0,0 +1,52 @@
+# OpenAI-compatible stand-in for /v1/chat/completions with a fixed latency,
+# so llm-service can be load tested without spending real tokens.
+import asyncio
+import json
+import os
+import random
+
+from fastapi import FastAPI
+
+import uvicorn
+
+
+fake_llm = FastAPI()
+
+LATENCY = float(os.getenv('FAKE_LLM_LATENCY', 0.5))
+JITTER = float(os.getenv('FAKE_LLM_JITTER', 0.1))
+
+
+@fake_llm.post('/v1/chat/completions')
+async def chat_completions(body: dict):
+    await asyncio.sleep(max(0.0, random.gauss(LATENCY, JITTER)))
+    content = json.dumps({
+        'load': random.choice(['free', 'average', 'full']),
+        'people_num': random.randint(0, 60),
+        'free_entrance': [random.randint(0, 3)],
+        'free_seats': random.randint(0, 30),
+    })
+    return {
+        'id': 'chatcmpl-fake',
+        'object': 'chat.completion',
+        'created': 0,
+        'model': body.get('model', 'fake'),
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'stop',
+            'message': {'role': 'assistant', 'content': content},
+        }],
+        'usage': {
+            'prompt_tokens': 9000,
+            'completion_tokens': 30,
+            'total_tokens': 9030,
+            'prompt_tokens_details': {'cached_tokens': 256},
+        },
+    }
+
+
+if __name__ == '__main__':
+    uvicorn.run(
+        app=fake_llm,
+        host='0.0.0.0',
+        port=int(os.getenv('FAKE_LLM_PORT', 9000))
+    )
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Closed-loop load generator for llm-service / crowd-analysis-service.
+
+    python load_test.py --url http://localhost:1337/api/v1/proc_image \
+        --image ../../../data/bus228.jpg --concurrency 64 --duration 30
+"""
+import argparse
+import asyncio
+import base64
+import time
+
+import httpx
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else 0.0
+
+
+def make_payload(url: str, image: str) -> dict:
+    frame = {
+        'image_bytes': image,
+        'cam_info': 'frontal',
+        'cam_num': 1,
+        'gate_pos': [1, 2],
+        'bus_num': '228',
+    }
+    if url.endswith('/crowd_analysis'):
+        return {'images': [frame, {**frame, 'cam_num': 2}]}
+    return frame
+
+
+async def run(url: str, payload: dict, concurrency: int, duration: float):
+    latencies, errors = [], 0
+    stop_at = time.monotonic() + duration
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.monotonic() < stop_at:
+            start = time.monotonic()
+            try:
+                response = await client.post(url, json=payload)
+                response.raise_for_status()
+                latencies.append(time.monotonic() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:1337/api/v1/proc_image')
+    parser.add_argument('--image', default='../../../data/bus228.jpg')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        payload = make_payload(args.url, base64.b64encode(f.read()).decode())
+
+    print(f"{'concurrency':>11} {'requests':>9} {'errors':>7} {'rps':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}")
+    for concurrency in args.concurrency:
+        r = asyncio.run(run(args.url, payload, concurrency, args.duration))
+        print(f"{concurrency:>11} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
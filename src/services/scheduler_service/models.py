@@ -0,0 +1,18 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Any
+
+class ProcRequest(BaseModel):
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    timestamp: Optional[int] = None
+    bus_num: str # with cam_num, the key of the camera's schedule
+    image_bytes: str
+    cam_num: int
+    cam_info: Optional[str] = None
+    gate_pos: Optional[list[int] | int] = None # list if frontal
+
+class ScheduleResponse(BaseModel):
+    sampled: bool = Field(description="True if the frame was sent to llm-service")
+    reason: str = Field(description="Why the frame was sampled or skipped")
+    next_sample_in: float = Field(description="Seconds until this camera is due again")
+    result: Optional[dict[str, Any]] = Field(None, description="Fresh proc_image result, or the last known one if skipped")
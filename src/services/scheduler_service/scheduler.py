@@ -0,0 +1,198 @@
+import json
+import time
+from collections import deque
+from math import cos, radians, sqrt
+
+from backend import MemoryBackend
+
+
+LOAD_LEVELS = {'free': 0, 'average': 1, 'full': 2}
+
+# people/min at which a camera is treated as fully "volatile"
+VOLATILITY_REF = 5.0
+# a load level step (free -> average) counts as this many people
+LOAD_STEP_PEOPLE = 5.0
+# moved less than this between two frames -> bus is standing (stop / traffic light)
+STATIONARY_METERS = 30.0
+# buses at or above this urgency may spend the budget reserve
+URGENT = 0.7
+
+CAMERA_PREFIX = 'scheduler:camera:'
+BUDGET_KEY = 'scheduler:budget'
+# forget cameras that have not sent a frame for a day
+STATE_TTL = 24 * 3600
+
+
+def parse_rush_hours(spec: str) -> list[tuple[int, int]]:
+    '''"7-10,17-20" -> [(7, 10), (17, 20)]'''
+    hours = []
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        start, end = part.split('-')
+        hours.append((int(start), int(end)))
+    return hours
+
+
+def distance_m(a: tuple[float, float], b: tuple[float, float]) -> float:
+    # equirectangular approximation is plenty for a few hundred meters
+    x = radians(b[1] - a[1]) * cos(radians((a[0] + b[0]) / 2))
+    y = radians(b[0] - a[0])
+    return sqrt(x * x + y * y) * 6371000
+
+
+class CameraState:
+    def __init__(self, history_size: int, data: dict | None = None):
+        data = data or {}
+        self.history = deque(map(tuple, data.get('history', [])), maxlen=history_size)  # (t, people_num, load_level)
+        self.last_sampled = data.get('last_sampled')
+        self.last_pos = tuple(data['last_pos']) if data.get('last_pos') else None
+        self.stationary = data.get('stationary', False)
+        self.last_result = data.get('last_result')
+
+    def to_json(self) -> bytes:
+        return json.dumps({
+            'history': list(self.history),
+            'last_sampled': self.last_sampled,
+            'last_pos': self.last_pos,
+            'stationary': self.stationary,
+            'last_result': self.last_result,
+        }).encode()
+
+
+class FrameScheduler:
+    '''
+    Decides how often each (bus_num, cam_num) goes to the LLM.
+
+    A camera is due when its interval has passed. The interval shrinks
+    from max_interval to min_interval with "urgency": how fast people_num/load
+    changed recently, how close the bus is to capacity and whether it is
+    standing (likely at a stop). Rush hours halve it. Every sample spends a token
+    from a global per-minute budget; non-urgent cameras leave a reserve for
+    the urgent ones.
+
+    Camera state and the budget live in `backend`, so several workers/replicas
+    share one schedule. Every change of a camera's state is an atomic
+    read-modify-write, so two workers never sample the same camera twice.
+    '''
+    def __init__(self, min_interval=10.0, max_interval=120.0, budget_per_minute=60,
+                 rush_hours=(), rush_factor=0.5, reserve_ratio=0.2, history_size=8,
+                 backend=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rush_hours = list(rush_hours)
+        self.rush_factor = rush_factor
+        self.history_size = history_size
+        self.budget = float(budget_per_minute)
+        self.reserve = budget_per_minute * reserve_ratio
+        self.backend = backend or MemoryBackend()
+
+    @staticmethod
+    def _key(key) -> str:
+        return CAMERA_PREFIX + ':'.join(map(str, key))
+
+    def _state(self, raw: bytes | None) -> CameraState:
+        return CameraState(self.history_size, json.loads(raw) if raw else None)
+
+    async def load(self, key) -> CameraState:
+        return self._state(await self.backend.get(self._key(key)))
+
+    async def _update(self, key, change):
+        '''change(state) edits the state in place and returns the result; may run more than once'''
+        def apply(raw):
+            state = self._state(raw)
+            result = change(state)
+            return state.to_json(), result
+        return await self.backend.update(self._key(key), apply, ttl=STATE_TTL)
+
+    async def cameras(self) -> list[tuple[tuple[str, int], CameraState]]:
+        # bus_num may itself contain ':', cam_num never does
+        names = [key[len(CAMERA_PREFIX):].rsplit(':', 1) for key in await self.backend.keys(CAMERA_PREFIX)]
+        return [((bus_num, int(cam_num)), await self.load((bus_num, cam_num))) for bus_num, cam_num in names]
+
+    def _volatility(self, state: CameraState) -> float:
+        h = state.history
+        if len(h) < 2:
+            return 0.0
+        change = 0.0
+        for (t0, p0, l0), (t1, p1, l1) in zip(h, list(h)[1:]):
+            change += abs(p1 - p0) + LOAD_STEP_PEOPLE * abs(l1 - l0)
+        minutes = max((h[-1][0] - h[0][0]) / 60, 1 / 60)
+        return change / minutes
+
+    def urgency(self, state: CameraState) -> float:
+        if not state.history:
+            return 1.0
+        volatility = min(1.0, self._volatility(state) / VOLATILITY_REF)
+        capacity = state.history[-1][2] / 2
+        result = (state.last_result or {}).get('proc_data') or {}
+        if result.get('free_seats') == 0:
+            capacity = max(capacity, 0.75)
+        stop = 1.0 if state.stationary else 0.0
+        return max(volatility, capacity, stop)
+
+    def _is_rush_hour(self, wall: float) -> bool:
+        hour = time.localtime(wall).tm_hour
+        return any(start <= hour < end for start, end in self.rush_hours)
+
+    def interval(self, state: CameraState, now: float | None = None) -> float:
+        u = self.urgency(state)
+        interval = self.max_interval - u * (self.max_interval - self.min_interval)
+        if self._is_rush_hour(time.time() if now is None else now):
+            interval *= self.rush_factor
+        return max(self.min_interval, interval)
+
+    async def decide(self, key, lat=None, lon=None, now=None) -> tuple[bool, str, float]:
+        '''Returns (sample?, reason, seconds until the camera is due again)'''
+        now = time.time() if now is None else now
+
+        def claim(state: CameraState):
+            # the due check and taking the slot are one atomic step
+            if lat is not None and lon is not None:
+                if state.last_pos is not None:
+                    state.stationary = distance_m(state.last_pos, (lat, lon)) < STATIONARY_METERS
+                state.last_pos = (lat, lon)
+            interval = self.interval(state, now)
+            previous = state.last_sampled
+            due = previous is None or now - previous >= interval
+            if due:
+                state.last_sampled = now
+            return due, previous, interval, self.urgency(state)
+
+        due, previous, interval, urgency = await self._update(key, claim)
+        if not due:
+            return False, 'not_due', interval - (now - previous)
+
+        reserve = 0 if urgency >= URGENT else self.reserve
+        taken, tokens = await self.backend.take_token(BUDGET_KEY, self.budget, self.budget / 60, reserve)
+        if not taken:
+            def release(state: CameraState):
+                if state.last_sampled == now:  # still our claim
+                    state.last_sampled = previous
+            await self._update(key, release)
+            return False, 'budget', (reserve + 1 - tokens) / (self.budget / 60)
+        return True, 'due', interval
+
+    async def cancel(self, key, claimed_at: float):
+        '''Gives back a sample decide() granted at `claimed_at` but that was not made: the camera's slot and the budget token'''
+        def release(state: CameraState):
+            if state.last_sampled == claimed_at:  # still our claim; the camera was due, so it is due again
+                state.last_sampled = None
+        await self._update(key, release)
+        await self.backend.return_token(BUDGET_KEY, self.budget)
+
+    async def record(self, key, result: dict, now=None):
+        '''Feed a fresh proc_image result back into the camera history'''
+        now = time.time() if now is None else now
+        proc_data = result.get('proc_data') or {}
+
+        def append(state: CameraState):
+            state.history.append((
+                now,
+                proc_data.get('people_num', 0),
+                LOAD_LEVELS.get(proc_data.get('load'), 0),
+            ))
+            state.last_result = result
+
+        await self._update(key, append)
+
+    async def last_result(self, key) -> dict | None:
+        return (await self.load(key)).last_result
@@ -0,0 +1,130 @@
+import time
+STARTED = time.monotonic()
+
+import os
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+from models import *
+from scheduler import FrameScheduler, parse_rush_hours
+from backend import make_backend
+
+import uvicorn
+
+
+LLM_SERVICE_URL = os.getenv('LLM_SERVICE_URL', 'http://llm-service:1337/api/v1/proc_image')
+LLM_SERVICE_READY_URL = str(httpx.URL(LLM_SERVICE_URL).join('/ready'))
+
+scheduler = FrameScheduler(
+    min_interval=float(os.getenv('SCHEDULER_MIN_INTERVAL', 10)),
+    max_interval=float(os.getenv('SCHEDULER_MAX_INTERVAL', 120)),
+    budget_per_minute=float(os.getenv('LLM_BUDGET_PER_MINUTE', 60)),
+    rush_hours=parse_rush_hours(os.getenv('RUSH_HOURS', '7-10,17-20')),
+    backend=make_backend(),
+)
+
+client: httpx.AsyncClient = None
+
+status = {'warm': False, 'startup_s': None}
+
+
+async def probe_upstream() -> bool:
+    try:
+        response = await client.get(LLM_SERVICE_READY_URL, timeout=5)
+        return response.status_code == 200
+    except httpx.HTTPError as e:
+        print(f'llm-service is not reachable: {e}')
+        return False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    client = httpx.AsyncClient(timeout=60)
+    await probe_upstream()
+    status['warm'] = True
+    status['startup_s'] = time.monotonic() - STARTED
+    print(f"scheduler-service started in {status['startup_s']:.2f}s")
+    yield
+    await client.aclose()
+    await scheduler.backend.close()
+
+
+scheduler_service = FastAPI(
+    prefix='/api/v1',
+    lifespan=lifespan,
+)
+
+
+@scheduler_service.get('/health')
+async def health():
+    return {'status': 'ok', 'startup_s': status['startup_s']}
+
+
+@scheduler_service.get('/ready')
+async def ready():
+    upstream_ok = status['warm'] and await probe_upstream()
+    return JSONResponse(
+        {'ready': upstream_ok, 'upstream_ok': upstream_ok, 'startup_s': status['startup_s']},
+        status_code=200 if upstream_ok else 503,
+    )
+
+
+@scheduler_service.post('/api/v1/schedule_image')
+async def schedule_image(req: ProcRequest):
+    key = (req.bus_num, req.cam_num)
+    now = time.time()
+    sampled, reason, next_in = await scheduler.decide(key, req.lat, req.lon, now)
+
+    if not sampled:
+        return ScheduleResponse(
+            sampled=False,
+            reason=reason,
+            next_sample_in=next_in,
+            result=await scheduler.last_result(key),
+        )
+
+    try:
+        response = await client.post(LLM_SERVICE_URL, json=req.model_dump())
+        response.raise_for_status()
+        result = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        print(e)
+        # an outage must not spend the budget or keep the camera waiting for its next interval
+        await scheduler.cancel(key, now)
+        raise HTTPException(500, 'llm-service is not available')
+
+    await scheduler.record(key, result)
+
+    return ScheduleResponse(
+        sampled=True,
+        reason=reason,
+        next_sample_in=next_in,
+        result=result,
+    )
+
+
+@scheduler_service.get('/api/v1/schedule')
+async def schedule_state():
+    return [
+        {
+            'bus_num': bus_num,
+            'cam_num': cam_num,
+            'urgency': scheduler.urgency(state),
+            'interval': scheduler.interval(state),
+            'stationary': state.stationary,
+        }
+        for (bus_num, cam_num), state in await scheduler.cameras()
+    ]
+
+
+if __name__ == '__main__':
+    uvicorn.run(
+        app='service:scheduler_service',
+        host='0.0.0.0',
+        port=1339,
+        workers=int(os.getenv('WORKERS', 1))
+    )
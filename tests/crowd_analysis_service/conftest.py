@@ -0,0 +1,30 @@
+import pathlib
+import sys
+
+
+SOURCE = pathlib.Path(__file__).resolve().parents[2] / 'src' / 'services' / 'crowd_analysis_service'
+
+# services import their modules flat (models, backend, ...) under the same names:
+# forget the ones another service's tests imported, then import from this one
+for name, module in list(sys.modules.items()):
+    path = getattr(module, '__file__', None) or ''
+    if path.startswith(str(SOURCE.parent)) and not path.startswith(str(SOURCE)):
+        del sys.modules[name]
+sys.path.insert(0, str(SOURCE))
+
+import pytest
+
+import backend as state_backend
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request, monkeypatch):
+    '''The shared state backend of several workers: in process memory, or Redis (fakeredis)'''
+    if request.param == 'memory':
+        return state_backend.MemoryBackend()
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # Lua scripts
+    import redis.asyncio
+
+    monkeypatch.setattr(redis.asyncio, 'from_url', lambda url: fakeredis.FakeAsyncRedis())
+    return state_backend.RedisBackend('redis://test')
@@ -0,0 +1,100 @@
+import asyncio
+import gzip
+import json
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import service as crowd_service
+from backend import MemoryBackend
+from edge import DONE, PENDING, BatchLedger, BatchTooLarge, delta_decode, gunzip, read_batch
+
+
+def test_batch_is_claimed_once_until_released(backend):
+    async def scenario():
+        ledger = BatchLedger(backend)
+        first, second = await ledger.claim('228/1'), await ledger.claim('228/1')
+        await ledger.release('228/1')  # the analysis failed: the retry owns it again
+        retry = await ledger.claim('228/1')
+        await ledger.done('228/1')
+        return first, second, retry, await ledger.claim('228/1')
+
+    assert asyncio.run(scenario()) == (None, PENDING, None, DONE)
+
+
+def test_pending_claim_lapses(backend):
+    async def scenario():
+        ledger = BatchLedger(backend, pending_ttl=0.1)
+        await ledger.claim('228/1')  # the worker died mid-analysis
+        await asyncio.sleep(0.2)
+        return await ledger.claim('228/1')
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_gunzip_stops_at_the_limit():
+    bomb = gzip.compress(bytes(10 * 2**20))
+    with pytest.raises(BatchTooLarge):
+        gunzip(bomb, 2**20)
+    with pytest.raises(ValueError):
+        gunzip(gzip.compress(b'{"type": "rssi"}\n')[:-8], 2**20)
+    with pytest.raises(zlib.error):
+        read_batch(b'\x1f\x8bnot gzip', None, 2**20)
+
+
+def test_delta_decode():
+    record = {'fields': ['minute', 'front'], 'encoding': 'delta', 'rows': [[100, 5], [1, 2], [1, -3]]}
+    assert delta_decode(record) == [{'minute': 100, 'front': 5}, {'minute': 101, 'front': 7}, {'minute': 102, 'front': 4}]
+
+
+BATCH = gzip.compress(b'\n'.join(json.dumps(r).encode() for r in [
+    {'type': 'frame', 'bus_num': '228', 'taken_at': 1760000000.0,
+     'image': {'cam_info': 'frontal', 'cam_num': 1, 'gate_pos': [1, 2], 'image_bytes': ''}},
+    {'type': 'rssi', 'bus_num': '228', 'fields': ['minute', 'front'], 'encoding': 'delta', 'rows': [[1, 2], [1, 1]]},
+]))
+HEADERS = {'Content-Encoding': 'gzip', 'X-Batch-Id': '228/batch-1'}
+
+
+@pytest.fixture
+def service(monkeypatch):
+    '''The crowd service on a fresh in-memory backend, with llm-service reported reachable'''
+    async def reachable():
+        return True
+
+    backend = MemoryBackend()
+    monkeypatch.setattr(crowd_service, 'probe_upstream', reachable)
+    monkeypatch.setattr(crowd_service, 'batches', BatchLedger(backend))
+    for component in (crowd_service.rssi_history, crowd_service.last_known, crowd_service.breaker):
+        monkeypatch.setattr(component, 'backend', backend)
+    return crowd_service
+
+
+def test_batch_failed_by_llm_service_stays_with_the_agent(service, monkeypatch):
+    priorities = []
+
+    async def down(image, deadline):
+        priorities.append(image['priority'])
+        return None
+
+    async def up(image, deadline):
+        return service.ProcResponse(proc_data=service.BusAnalysisResponse(
+            load='free', people_num=3, free_entrance=[1], free_seats=4))
+
+    with TestClient(service.crowd_analysys_service) as client:
+        monkeypatch.setattr(service, 'process_image', down)
+        failed = client.post('/api/v1/edge/ingest', content=BATCH, headers=HEADERS)
+        retried = client.post('/api/v1/edge/ingest', content=BATCH, headers=HEADERS)
+        rssi_after_failure = client.get('/api/v1/edge/rssi/228').json()
+
+        monkeypatch.setattr(service, 'process_image', up)
+        accepted = client.post('/api/v1/edge/ingest', content=BATCH, headers=HEADERS)
+        duplicate = client.post('/api/v1/edge/ingest', content=BATCH, headers=HEADERS)
+        rssi = client.get('/api/v1/edge/rssi/228').json()
+
+    assert (failed.status_code, retried.status_code) == (503, 503)
+    assert rssi_after_failure == []
+    assert priorities == ['low', 'low']  # backfill never competes with riders
+    assert accepted.status_code == 200 and not accepted.json()['duplicate']
+    assert duplicate.json()['duplicate']
+    assert rssi == [{'minute': 1, 'front': 2}, {'minute': 2, 'front': 3}]
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from freshness import CircuitBreaker, LastKnown
+from models import CrowdAnalysisResponse
+
+
+RESET_S = 0.2
+
+
+def result(seats):
+    return CrowdAnalysisResponse(seats=seats, people=10, free_entrance=1)
+
+
+async def open_breaker(backend):
+    # two workers sharing one backend
+    workers = [CircuitBreaker(backend, failures=2, reset_s=RESET_S) for _ in range(2)]
+    for _ in range(2):
+        await workers[0].failure()
+    return workers
+
+
+async def admitted_worker(workers):
+    for worker in workers:
+        if await worker.admit():
+            return worker
+    raise AssertionError('no worker got the trial')
+
+
+def test_breaker_opens_for_every_worker(backend):
+    async def scenario():
+        workers = await open_breaker(backend)
+        return [await w.state() for w in workers], [await w.admit() for w in workers]
+
+    assert asyncio.run(scenario()) == (['open', 'open'], [False, False])
+
+
+def test_half_open_admits_one_request_over_all_workers(backend):
+    async def scenario():
+        workers = await open_breaker(backend)
+        await asyncio.sleep(RESET_S)
+        states = [await w.state() for w in workers]
+        admitted = [await w.admit() for w in workers for _ in range(3)]
+        return states, admitted
+
+    states, admitted = asyncio.run(scenario())
+    assert states == ['half_open', 'half_open']
+    assert admitted.count(True) == 1
+
+
+def test_successful_trial_closes_the_breaker(backend):
+    async def scenario():
+        workers = await open_breaker(backend)
+        await asyncio.sleep(RESET_S)
+        trial = await admitted_worker(workers)
+        await trial.success()
+        return [await w.state() for w in workers], [await w.admit() for w in workers]
+
+    assert asyncio.run(scenario()) == (['closed', 'closed'], [True, True])
+
+
+def test_failed_trial_reopens_for_another_period(backend):
+    async def scenario():
+        workers = await open_breaker(backend)
+        await asyncio.sleep(RESET_S)
+        trial = await admitted_worker(workers)
+        await trial.failure()  # a single failure is enough while half-open
+        reopened = [await w.admit() for w in workers]
+        await asyncio.sleep(RESET_S)
+        next_trial = [await w.admit() for w in workers]
+        return reopened, next_trial
+
+    reopened, next_trial = asyncio.run(scenario())
+    assert reopened == [False, False]
+    assert next_trial.count(True) == 1
+
+
+def test_last_known_keeps_the_newest_result(backend):
+    async def scenario():
+        last_known = LastKnown(backend, ttl=60)
+        now = time.time()
+        await last_known.put('228', result(5), updated=now - 1)
+        await last_known.put('228', result(7), updated=now - 30)  # late upload of older frames
+        return await last_known.get('228'), await last_known.get('45')
+
+    (cached, age), missing = asyncio.run(scenario())
+    assert cached.seats == 5
+    assert 1 <= age < 5
+    assert missing is None
+
+
+def test_one_refresh_per_bus(backend):
+    async def scenario():
+        last_known = LastKnown(backend)
+        claims = [await last_known.claim_refresh('228', ttl=10) for _ in range(3)]
+        await last_known.release_refresh('228')
+        return claims, await last_known.claim_refresh('228', ttl=10)
+
+    assert asyncio.run(scenario()) == ([True, False, False], True)
+
+
+class Unavailable:
+    '''A backend whose server is down'''
+    def __getattr__(self, name):
+        async def fail(*args, **kwargs):
+            raise ConnectionError('backend is down')
+        return fail
+
+
+def test_backend_errors_are_a_cache_miss():
+    async def scenario():
+        last_known = LastKnown(Unavailable())
+        await last_known.put('228', result(5))
+        breaker = CircuitBreaker(Unavailable())
+        return await last_known.get('228'), await breaker.admit(), await breaker.state()
+
+    assert asyncio.run(scenario()) == (None, True, 'closed')
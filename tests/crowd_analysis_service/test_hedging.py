@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from fleet import FairPool
+from hedging import LatencyTracker, hedged
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled():
+    async def scenario():
+        delays = [1.0, 0.01]
+        cancelled = []
+
+        async def call():
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return delay
+
+        result = await asyncio.wait_for(hedged(call, delay=0.05), timeout=0.5)
+        await asyncio.sleep(0)
+        return result, cancelled
+
+    assert asyncio.run(scenario()) == (0.01, [1.0])
+
+
+def test_failed_attempt_falls_back_to_the_hedge():
+    async def scenario():
+        attempts = []
+
+        async def call():
+            attempts.append(len(attempts))
+            if len(attempts) == 1:
+                await asyncio.sleep(0.1)
+                raise ConnectionError('first attempt failed')
+            await asyncio.sleep(0.2)
+            return 'hedge'
+
+        return await hedged(call, delay=0.05)
+
+    assert asyncio.run(scenario()) == 'hedge'
+
+
+def test_cancelled_caller_cancels_upstream_calls():
+    async def scenario():
+        running = []
+
+        async def call():
+            running.append(1)
+            try:
+                await asyncio.sleep(10)
+            finally:
+                running.pop()
+
+        task = asyncio.ensure_future(hedged(call, delay=0.01))
+        await asyncio.sleep(0.05)  # the first call and its hedge are in flight
+        started = len(running)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return started, len(running)
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+def test_hedge_delay_is_the_percentile():
+    tracker = LatencyTracker(percentile=0.9, default=5, min_samples=10)
+    assert tracker.hedge_delay() == 5
+    for ms in range(1, 101):
+        tracker.observe(ms / 1000)
+    assert tracker.hedge_delay() == pytest.approx(0.091)
+
+
+def test_pool_takes_buses_in_turn():
+    async def scenario():
+        pool = FairPool(1)
+        order = []
+
+        async def work(name):
+            order.append(name)
+
+        futures = [pool.submit('big', lambda i=i: work(f'big{i}')) for i in range(3)]
+        futures.append(pool.submit('small', lambda: work('small')))
+        pool.start()
+        await asyncio.gather(*futures)
+        await pool.close()
+        return order
+
+    assert asyncio.run(scenario()) == ['big0', 'small', 'big1', 'big2']
+
+
+def test_pool_drops_cancelled_work_and_passes_errors():
+    async def scenario():
+        pool = FairPool(1)
+        ran = []
+
+        async def work(name):
+            ran.append(name)
+            if name == 'bad':
+                raise ValueError(name)
+            return name
+
+        dropped = pool.submit('228', lambda: work('dropped'))
+        bad = pool.submit('228', lambda: work('bad'))
+        good = pool.submit('228', lambda: work('good'))
+        dropped.cancel()
+        pool.start()
+        results = await asyncio.gather(bad, good, return_exceptions=True)
+        await pool.close()
+        return ran, results
+
+    ran, (bad, good) = asyncio.run(scenario())
+    assert ran == ['bad', 'good']
+    assert isinstance(bad, ValueError) and good == 'good'
@@ -0,0 +1,66 @@
+import asyncio
+import random
+import time
+
+from spatial import haversine_m, make_bus_index
+
+
+CENTER = (55.75, 37.62)
+
+
+def brute_force(buses, lat, lon, k=None, radius_m=None, min_free_seats=None):
+    found = sorted(
+        (haversine_m(lat, lon, b_lat, b_lon), bus_num)
+        for bus_num, (b_lat, b_lon, seats) in buses.items()
+        if min_free_seats is None or seats >= min_free_seats
+    )
+    found = [bus_num for distance, bus_num in found if radius_m is None or distance <= radius_m]
+    return found if k is None else found[:k]
+
+
+def test_queries_match_brute_force(backend):
+    rng = random.Random(1)
+    buses = {
+        str(n): (CENTER[0] + rng.uniform(-0.1, 0.1), CENTER[1] + rng.uniform(-0.1, 0.1), rng.randint(0, 40))
+        for n in range(300)
+    }
+
+    async def scenario():
+        index = make_bus_index(backend)
+        for bus_num, (lat, lon, seats) in buses.items():
+            await index.update(bus_num, lat, lon, seats, 'average')
+        nearest = await index.nearest(*CENTER, k=10)
+        filtered = await index.nearest(*CENTER, k=10, min_free_seats=30)
+        within = await index.within(*CENTER, radius_m=2000)
+        return nearest, filtered, within
+
+    nearest, filtered, within = asyncio.run(scenario())
+    # GEO hashes positions to ~0.6 m, so compare the buses, not the distances
+    assert [b['bus_num'] for b in nearest] == brute_force(buses, *CENTER, k=10)
+    assert [b['bus_num'] for b in filtered] == brute_force(buses, *CENTER, k=10, min_free_seats=30)
+    assert {b['bus_num'] for b in within} == set(brute_force(buses, *CENTER, radius_m=2000))
+
+
+def test_older_position_does_not_replace_a_newer_one(backend):
+    async def scenario():
+        index = make_bus_index(backend)
+        now = time.time()
+        await index.update('228', *CENTER, 10, 'free', updated=now)
+        await index.update('228', CENTER[0] + 0.05, CENTER[1], 0, 'full', updated=now - 60)
+        return await index.nearest(*CENTER, k=1)
+
+    [bus] = asyncio.run(scenario())
+    assert (bus['free_seats'], bus['load']) == (10, 'free')
+    assert bus['distance_m'] < 1
+
+
+def test_stale_buses_are_left_out(backend):
+    async def scenario():
+        index = make_bus_index(backend, max_age_s=60)
+        await index.update('old', *CENTER, 10, 'free', updated=time.time() - 120)
+        await index.update('new', *CENTER, 10, 'free')
+        return await index.nearest(*CENTER, k=5), await index.nearest(*CENTER, k=5, max_age_s=600)
+
+    default, wider = asyncio.run(scenario())
+    assert [b['bus_num'] for b in default] == ['new']
+    assert {b['bus_num'] for b in wider} == {'old', 'new'}
@@ -0,0 +1,13 @@
+import pathlib
+import sys
+
+
+SOURCE = pathlib.Path(__file__).resolve().parents[2] / 'src' / 'services' / 'llm_service'
+
+# services import their modules flat (models, backend, ...) under the same names:
+# forget the ones another service's tests imported, then import from this one
+for name, module in list(sys.modules.items()):
+    path = getattr(module, '__file__', None) or ''
+    if path.startswith(str(SOURCE.parent)) and not path.startswith(str(SOURCE)):
+        del sys.modules[name]
+sys.path.insert(0, str(SOURCE))
@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from priority import HIGH, LOW, PriorityLimiter
+
+
+async def call(limiter, priority, seconds, waits):
+    enqueued = time.monotonic()
+    async with limiter.slot(priority):
+        waits.append(time.monotonic() - enqueued)
+        await asyncio.sleep(seconds)
+
+
+async def high_waits_behind_batch(low_calls):
+    limiter = PriorityLimiter(capacity=4, reserved=1, max_low_wait=0.3, low_every=4)
+    low_waits, high_waits = [], []
+    batch = [asyncio.ensure_future(call(limiter, LOW, 0.02, low_waits)) for _ in range(low_calls)]
+    await asyncio.sleep(0.5)  # the head of the low queue is now older than max_low_wait
+    for _ in range(20):
+        await asyncio.gather(*(call(limiter, HIGH, 0.02, high_waits) for _ in range(2)))
+    await asyncio.gather(*batch)
+    return high_waits, low_waits
+
+
+def test_aged_batch_does_not_block_high_priority():
+    high_waits, low_waits = asyncio.run(high_waits_behind_batch(400))
+    assert max(high_waits) < 0.1
+    assert len(low_waits) == 400
+
+
+def test_batch_progresses_while_high_is_busy():
+    async def scenario():
+        limiter = PriorityLimiter(capacity=2, reserved=1, max_low_wait=0.05, low_every=2)
+        low_waits, high_waits = [], []
+        stop = time.monotonic() + 1
+        low = asyncio.ensure_future(call(limiter, LOW, 0.01, low_waits))
+
+        async def rider():
+            while time.monotonic() < stop:
+                await call(limiter, HIGH, 0.01, high_waits)
+
+        await asyncio.gather(*(rider() for _ in range(4)))
+        await low
+        return low_waits
+
+    low_waits = asyncio.run(scenario())
+    assert low_waits and low_waits[0] < 0.5
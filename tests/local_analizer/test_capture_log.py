@@ -0,0 +1,59 @@
+import os
+
+from capture_log import HEADER_SIZE, RECORD, CaptureLog, load_dataframe, read_segment
+
+
+SEGMENT_BYTES = HEADER_SIZE + 100 * RECORD.itemsize
+
+
+def test_records_survive_without_close(tmp_path):
+    log = CaptureLog(str(tmp_path), SEGMENT_BYTES)
+    for i in range(250):
+        log.append(1_000_000 + i, -40 - i % 50, 6, i % 3)
+    log.flush()
+
+    # another process reading while the log is still open
+    df = load_dataframe(str(tmp_path))
+    assert len(df) == 250
+    assert df['rssi'].tolist()[:3] == [-40, -41, -42]
+    assert df['receiver'].tolist()[:3] == [0, 1, 2]
+    assert len(log.segments) == 3
+    log.close()
+
+
+def test_segments_are_allocated_up_front(tmp_path):
+    log = CaptureLog(str(tmp_path), SEGMENT_BYTES)
+    log.append(1, -50)
+    log.flush()
+    [path] = log.segments
+    assert os.path.getsize(path) == SEGMENT_BYTES
+    assert os.stat(path).st_blocks * 512 >= SEGMENT_BYTES  # not a sparse file
+    assert len(read_segment(path)) == 1
+    log.close()
+
+
+def test_read_range_starts_at_the_position(tmp_path):
+    log = CaptureLog(str(tmp_path), SEGMENT_BYTES)
+    for i in range(150):
+        log.append(i, -50)
+    start = log.position()
+    for i in range(150, 180):
+        log.append(i, -50)
+    chunks = log.read_range(start)
+    assert [int(ts) for chunk in chunks for ts in chunk['ts_us']] == list(range(150, 180))
+    log.close()
+
+
+def test_retention_removes_the_oldest_segments(tmp_path):
+    log = CaptureLog(str(tmp_path), SEGMENT_BYTES, retention_bytes=3 * SEGMENT_BYTES)
+    for i in range(1000):
+        log.append(i, -50)
+    log.flush()
+
+    remaining = sorted(os.listdir(tmp_path))
+    assert len(remaining) == 3
+    assert os.path.basename(log.segments[-1]) in remaining  # the current one is kept
+    assert load_dataframe(str(tmp_path))['datetime'].is_monotonic_increasing
+    # read_range skips the pruned segments
+    assert sum(len(c) for c in log.read_range((0, 0))) == 1000 - 7 * 100
+    log.close()
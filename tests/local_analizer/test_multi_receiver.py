@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+
+from multi_receiver import MultiReceiverAnalyzer, Receiver, StreamMerger
+
+
+def receivers_with(streams):
+    receivers = [Receiver(i, f'port{i}', i / max(1, len(streams) - 1)) for i in range(len(streams))]
+    for receiver, stream in zip(receivers, streams):
+        receiver.pending.extend((ts, -50, 1) for ts in stream)
+    return receivers
+
+
+def test_merge_is_ordered_by_time():
+    rng = random.Random(0)
+    streams = [sorted(rng.sample(range(1_000_000), 500)) for _ in range(3)]
+    receivers = receivers_with(streams)
+
+    merged = list(StreamMerger(receivers).pop_ready(now=0, flush=True))
+
+    assert [ts for ts, *_ in merged] == sorted(ts for stream in streams for ts in stream)
+    assert sorted(index for _, index, *_ in merged) == sorted(i for i, s in enumerate(streams) for _ in s)
+
+
+def test_merge_waits_for_every_receiver_until_lateness():
+    receivers = receivers_with([[1_000, 2_000], []])
+    merger = StreamMerger(receivers, lateness_ms=500)
+
+    # receiver 1 may still send something earlier than 1000
+    assert list(merger.pop_ready(now=100_000)) == []
+    receivers[1].pending.append((1_500, -60, 1))
+    assert [ts for ts, *_ in merger.pop_ready(now=100_000)] == [1_000, 1_500]
+    # 2000 has no later packet from receiver 1, but it is older than lateness_ms
+    assert [ts for ts, *_ in merger.pop_ready(now=2_000 + 500_000)] == [2_000]
+    assert len(merger) == 0
+
+
+def test_merge_across_drains_stays_ordered():
+    rng = random.Random(1)
+    streams = [sorted(rng.sample(range(1_000_000), 300)) for _ in range(3)]
+    receivers = receivers_with([[] for _ in streams])
+    merger = StreamMerger(receivers, lateness_ms=50)
+
+    merged = []
+    for now in range(0, 1_100_000, 10_000):
+        # packets arrive with up to 20 ms delay, every receiver in its own order
+        for receiver, stream in zip(receivers, streams):
+            while stream and stream[0] <= now - 20_000:
+                receiver.pending.append((stream.pop(0), -50, 1))
+        merged += [ts for ts, *_ in merger.pop_ready(now)]
+    merged += [ts for ts, *_ in merger.pop_ready(now, flush=True)]
+
+    assert merged == sorted(merged)
+    assert len(merged) == 900
+
+
+def test_match_frames(tmp_path):
+    analyzer = MultiReceiverAnalyzer([('a', 0), ('b', 0.5), ('c', 1)], output_dir=str(tmp_path), match_window_ms=8)
+    ts = np.array([0, 2_000, 5_000, 6_000, 20_000, 21_000, 40_000])
+    receiver = np.array([0, 1, 2, 0, 1, 1, 2])
+    # a frame takes one packet per receiver within 8 ms of its first packet
+    assert analyzer.match_frames(ts, receiver).tolist() == [0, 0, 0, 1, 2, 3, 4]
@@ -0,0 +1,80 @@
+import asyncio
+import importlib.util
+import pathlib
+
+import pytest
+
+
+SERVICES = pathlib.Path(__file__).resolve().parents[1] / 'src' / 'services'
+COPIES = sorted(SERVICES.glob('*/backend.py'))
+
+
+def load_backend():
+    # loaded under its own name, so it does not shadow the per-service `backend` of other tests
+    spec = importlib.util.spec_from_file_location('shared_backend', COPIES[0])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+shared = load_backend()
+
+
+def test_copies_are_identical():
+    assert len(COPIES) == 3
+    for copy in COPIES[1:]:
+        assert copy.read_bytes() == COPIES[0].read_bytes(), f'{copy} differs from {COPIES[0]}'
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request, monkeypatch):
+    if request.param == 'memory':
+        return shared.MemoryBackend()
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # Lua scripts
+    import redis.asyncio
+
+    monkeypatch.setattr(redis.asyncio, 'from_url', lambda url: fakeredis.FakeAsyncRedis())
+    return shared.RedisBackend('redis://test')
+
+
+def test_update_retries_on_concurrent_writes(backend):
+    async def scenario():
+        def increment(raw):
+            value = int(raw or 0) + 1
+            return str(value).encode(), value
+
+        await asyncio.gather(*(backend.update('counter', increment) for _ in range(50)))
+        return int(await backend.get('counter'))
+
+    assert asyncio.run(scenario()) == 50
+
+
+def test_set_if_absent(backend):
+    async def scenario():
+        first = await backend.set_if_absent('claim', b'1', ttl=10)
+        second = await backend.set_if_absent('claim', b'2', ttl=10)
+        await backend.delete('claim')
+        third = await backend.set_if_absent('claim', b'3', ttl=10)
+        return first, second, third, await backend.get('claim')
+
+    assert asyncio.run(scenario()) == (True, False, True, b'3')
+
+
+def test_push_keeps_the_tail(backend):
+    async def scenario():
+        await backend.push('rows', [b'1', b'2', b'3'], maxlen=4)
+        await backend.push('rows', [b'4', b'5'], maxlen=4)
+        return await backend.tail('rows', 3)
+
+    assert asyncio.run(scenario()) == [b'3', b'4', b'5']
+
+
+def test_token_bucket_and_return(backend):
+    async def scenario():
+        taken = [(await backend.take_token('budget', capacity=2, rate=0))[0] for _ in range(3)]
+        await backend.return_token('budget', capacity=2)
+        again, _ = await backend.take_token('budget', capacity=2, rate=0)
+        return taken, again
+
+    assert asyncio.run(scenario()) == ([True, True, False], True)